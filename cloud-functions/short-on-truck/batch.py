@@ -1,38 +1,51 @@
-import os
-import requests
-import json
+import threading
 import functions_framework
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from google.cloud import workflows_v1
+from datetime import datetime, timedelta, timezone
 
-load_dotenv()
+from token_cache import get_oauth_token
+from workflow_dispatch import WorkflowDispatcher
+from sf_query import iter_query_records
+from state_store import get_state_store, InMemoryStateStore
+from dispatch_ledger import get_dispatch_ledger
+from settings import get_settings
 
-def get_oauth_token():
-    """Get OAuth token using client credentials via API gateway"""
-    token_url = f"{os.getenv('GATEWAY_URL')}/token"
-    
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': os.getenv('CLIENT_ID'),
-        'client_secret': os.getenv('CLIENT_SECRET')
-    }
-    
-    response = requests.post(token_url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to get token: {response.text}")
 
-def get_cases_from_last_15_days():
-    """Get case IDs from last 15 days"""
+# Page size requested from Salesforce and overall cap on cases per batch run
+BATCH_PAGE_SIZE = get_settings().batch_page_size
+BATCH_MAX_CASES = get_settings().batch_max_cases
+
+# State store key holding the (CreatedDate, Id) of the newest case already dispatched
+WATERMARK_KEY = 'batch_case_watermark'
+
+def parse_sf_datetime(value):
+    """Parse a Salesforce datetime (2024-05-01T10:00:00.000+0000) into an aware UTC datetime"""
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f%z').astimezone(timezone.utc)
+
+def format_soql_datetime(value):
+    """Format an aware datetime as a SOQL datetime literal"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def case_sort_key(record):
+    return parse_sf_datetime(record['CreatedDate']), record['Id']
+
+def iter_case_records(page_size=None, max_cases=None, watermark=None, scan=None):
+    """Yield case records from last 15 days page by page, following query pagination lazily.
+
+    The query is ordered by CreatedDate, then Id, and with a watermark only cases
+    created after it are returned. When a scan dict is given, it records how many
+    rows the query returned ('rows'), whether the scan stopped at max_cases
+    ('capped') and whether the rows really came back in order ('ordered').
+    """
     try:
         token_response = get_oauth_token()
         access_token = token_response['access_token']
         
         # Calculate date 15 days ago
-        fifteen_days_ago = (datetime.now() - timedelta(days=15)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        since = datetime.now(timezone.utc) - timedelta(days=15)
+        watermark_key = None
+        if watermark:
+            watermark_key = (parse_sf_datetime(watermark['created_date']), watermark['id'])
+            since = max(since, watermark_key[0])
         
         headers = {
             'Authorization': f'Bearer {access_token}',
@@ -40,45 +53,92 @@ def get_cases_from_last_15_days():
         }
         
         # Updated query with date filter for last 15 days
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Case/query"
+        url = f"{get_settings().crm_url}/sobjects/Case/query"
+        filters = f"Subject LIKE '%Credit%' AND Status LIKE '%New%' AND OwnerId='00G0y000003TEGc' AND CreatedDate >= {format_soql_datetime(since)}"
+        if watermark_key:
+            # Keyset condition, so cases sharing the watermark second that were already seen never count towards the cap
+            watermark_date = format_soql_datetime(watermark_key[0])
+            filters += f" AND (CreatedDate > {watermark_date} OR (CreatedDate = {watermark_date} AND Id > '{watermark_key[1]}'))"
         params = {
-            'fields': 'Id, CaseNumber, Subject, Status, OwnerId',
-            'filters': f"Subject LIKE '%Credit%' AND Status LIKE '%New%' AND OwnerId='00G0y000003TEGc' AND CreatedDate >= {fifteen_days_ago}"
+            'fields': 'Id, CaseNumber, Subject, Status, OwnerId, CreatedDate',
+            'filters': f"{filters} ORDER BY CreatedDate, Id"
         }
         
-        response = requests.get(url, headers=headers, params=params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            case_ids = [record['Id'] for record in data.get('records', [])]
-            return case_ids
-        else:
-            raise Exception(f"Failed to get cases: {response.text}")
+        max_records = max_cases if max_cases is not None else BATCH_MAX_CASES
+        if scan is None:
+            scan = {}
+        scan.update(rows=0, capped=False, ordered=True)
+        
+        previous_key = None
+        records = iter_query_records(url, params, headers, page_size=page_size or BATCH_PAGE_SIZE, max_records=max_records)
+        for record in records:
+            scan['rows'] += 1
+            scan['capped'] = scan['rows'] >= max_records
+            record_key = case_sort_key(record)
+            if previous_key is not None and record_key < previous_key:
+                scan['ordered'] = False
+            previous_key = max(previous_key, record_key) if previous_key is not None else record_key
+            
+            # Also filtered locally, in case the gateway drops the keyset condition
+            if watermark_key and record_key <= watermark_key:
+                continue
+            yield record
             
     except Exception as e:
         raise Exception(f"Error getting cases: {str(e)}")
 
+def iter_case_ids(page_size=None, max_cases=None, watermark=None):
+    """Yield case IDs from last 15 days page by page"""
+    for record in iter_case_records(page_size, max_cases, watermark):
+        yield record['Id']
+
+def get_cases_from_last_15_days():
+    """Get case IDs from last 15 days"""
+    return list(iter_case_ids())
+
+def next_watermark(watermark, records, failed_case_ids):
+    """Newest (CreatedDate, Id) that is safe to skip next run.
+
+    The watermark never moves past a case whose dispatch failed, so it is picked
+    up again, and never moves backwards.
+    """
+    keys = sorted(case_sort_key(record) for record in records)
+    failed = [case_sort_key(record) for record in records if record['Id'] in failed_case_ids]
+    if failed:
+        keys = [key for key in keys if key < min(failed)]
+    if not keys:
+        return watermark
+    
+    newest = keys[-1]
+    if watermark and newest <= (parse_sf_datetime(watermark['created_date']), watermark['id']):
+        return watermark
+    return {'created_date': format_soql_datetime(newest[0]), 'id': newest[1]}
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_workflow_dispatcher():
+    """Get the dispatcher holding the container-wide executions client, creating it on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            from google.cloud.workflows import executions_v1
+            
+            settings = get_settings()
+            _dispatcher = WorkflowDispatcher(
+                executions_v1.ExecutionsClient(),
+                settings.workflow_parent,
+                max_workers=settings.workflow_max_workers,
+                rate_per_second=settings.workflow_rate_per_second,
+                max_retries=settings.workflow_max_retries,
+                ledger=get_dispatch_ledger()
+            )
+        return _dispatcher
+
 def trigger_workflow_for_case(case_id):
     """Trigger workflow for a single case ID"""
     try:
-        from google.cloud.workflows import executions_v1
-        
-        client = executions_v1.ExecutionsClient()
-        
-        # Replace with your actual project, location, and workflow name
-        parent = f"projects/{os.getenv('PROJECT_ID')}/locations/{os.getenv('LOCATION')}/workflows/{os.getenv('WORKFLOW_NAME')}"
-        
-        execution = executions_v1.Execution(
-            argument=json.dumps({"caseid": case_id})
-        )
-        
-        operation = client.create_execution(
-            parent=parent,
-            execution=execution
-        )
-        
-        return {"success": True, "case_id": case_id, "execution_name": operation.name}
-        
+        return get_workflow_dispatcher().trigger(case_id)
     except Exception as e:
         return {"success": False, "case_id": case_id, "error": str(e)}
 
@@ -86,29 +146,67 @@ def trigger_workflow_for_case(case_id):
 def batch_process_cases(request):
     """HTTP Cloud Function to get cases from last 15 days and trigger workflow for each"""
     try:
-        # Get case IDs from last 15 days
-        case_ids = get_cases_from_last_15_days()
+        request_json = request.get_json(silent=True) or {}
+        page_size = request_json.get('page_size')
+        max_cases = request_json.get('max_cases')
+        
+        # Incremental runs only pick up cases newer than the stored watermark; 'full' re-scans the whole window
+        scan_mode = request_json.get('mode') or get_settings().batch_scan_mode
+        state_store = get_state_store()
+        if scan_mode == 'incremental' and isinstance(state_store, InMemoryStateStore):
+            # A per-instance watermark would make the scanned window depend on which instance handles the run
+            raise Exception("Incremental scans need STATE_BUCKET or STATE_FILE; use mode 'full' without a durable state store")
+        watermark = state_store.get(WATERMARK_KEY)
+        
+        # Dispatch cases as pages arrive; a failed later page keeps what was already dispatched
+        records = []
+        discovery_errors = []
+        scan = {}
+        def discovered_case_ids():
+            try:
+                for record in iter_case_records(page_size, max_cases, watermark if scan_mode == 'incremental' else None, scan):
+                    records.append(record)
+                    yield record['Id']
+            except Exception as e:
+                discovery_errors.append(str(e))
+        
+        results = get_workflow_dispatcher().dispatch(discovered_case_ids())
+        case_ids = [r["case_id"] for r in results]
+        
+        # Rows arrive in (CreatedDate, Id) order, so even a capped or interrupted scan has seen every
+        # case up to its last row; if the order was not honoured, only a complete scan may advance
+        new_watermark = watermark
+        scan_complete = not discovery_errors and not scan.get('capped', False)
+        if scan.get('ordered', False) or scan_complete:
+            failed_case_ids = {r["case_id"] for r in results if not r["success"]}
+            new_watermark = next_watermark(watermark, records, failed_case_ids)
+            if new_watermark != watermark:
+                state_store.set(WATERMARK_KEY, new_watermark)
+        
+        if discovery_errors and not case_ids:
+            return {"error": discovery_errors[0]}, 500
         
         if not case_ids:
-            return {"message": "No cases found from last 15 days", "case_count": 0}
-        
-        # Trigger workflow for each case
-        results = []
-        for case_id in case_ids:
-            result = trigger_workflow_for_case(case_id)
-            results.append(result)
+            return {"message": "No cases found from last 15 days", "case_count": 0, "scan_mode": scan_mode}
         
-        successful_triggers = [r for r in results if r["success"]]
+        duplicate_triggers = [r for r in results if r.get("duplicate")]
+        successful_triggers = [r for r in results if r["success"] and not r.get("duplicate")]
         failed_triggers = [r for r in results if not r["success"]]
         
-        return {
+        response = {
             "message": f"Processed {len(case_ids)} cases from last 15 days",
             "total_cases": len(case_ids),
             "successful_triggers": len(successful_triggers),
             "failed_triggers": len(failed_triggers),
+            "skipped_duplicates": len(duplicate_triggers),
             "case_ids": case_ids,
-            "results": results
+            "results": results,
+            "scan_mode": scan_mode,
+            "watermark": new_watermark
         }
+        if discovery_errors:
+            response["discovery_error"] = discovery_errors[0]
+        return response
         
     except Exception as e:
         return {"error": str(e)}, 500
\ No newline at end of file
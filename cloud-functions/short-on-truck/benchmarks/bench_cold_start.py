@@ -0,0 +1,87 @@
+"""Import-time / cold-start benchmark for the Cloud Function entry points.
+
+Each entry point is imported in a fresh interpreter, as a new instance would,
+and the wall time to a ready handler is reported as the median over the runs.
+With --budget-ms the script exits non-zero when any entry point is slower, so
+it can gate a build. --top lists the slowest imports (by -X importtime
+cumulative time) for each entry point.
+
+    python benchmarks/bench_cold_start.py [--runs 5] [--budget-ms 800] [--top 5]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (source file, handler) for every deployed entry point
+ENTRY_POINTS = [
+    ('get-case-details.py', 'get_case_details'),
+    ('child-sr.py', 'childsr_handler'),
+    ('unrelated-handler.py', 'unrelated_handler'),
+    ('batch.py', 'batch_process_cases'),
+    ('validation.py', 'send_to_validation'),
+    ('validation.py', 'send_to_validation_batch')
+]
+
+# Loads the handler the way the framework does and prints the elapsed milliseconds
+LOADER = """
+import sys, time, importlib.util
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('entry_point', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+getattr(module, sys.argv[2])
+print((time.perf_counter() - started) * 1000)
+"""
+
+def measure(source, handler, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', LOADER, os.path.join(FUNCTION_DIR, source), handler]
+    completed = subprocess.run(command, cwd=FUNCTION_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise Exception(f"Importing {source} failed: {completed.stderr.strip().splitlines()[-1:]}")
+    return float(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+def slowest_imports(importtime_log, top):
+    """Top-level imports by cumulative microseconds, from -X importtime output"""
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if not name.startswith(' '):
+            imports.append((int(cumulative), name))
+    return sorted(imports, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None)
+    parser.add_argument('--top', type=int, default=0)
+    args = parser.parse_args()
+
+    over_budget = []
+    for source, handler in ENTRY_POINTS:
+        timings = [measure(source, handler)[0] for _ in range(args.runs)]
+        median = statistics.median(timings)
+        print(f"{handler:<26} median {median:8.1f} ms  min {min(timings):8.1f} ms  max {max(timings):8.1f} ms")
+
+        if args.top:
+            _, importtime_log = measure(source, handler, importtime=True)
+            for cumulative, name in slowest_imports(importtime_log, args.top):
+                print(f"{'':<28}{cumulative / 1000:8.1f} ms  {name}")
+
+        if args.budget_ms is not None and median > args.budget_ms:
+            over_budget.append(handler)
+
+    if over_budget:
+        print(f"Over the {args.budget_ms:.0f} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Microbenchmark for the credits_eligibility grouping phase.
+
+Compares the previous per-result rescan of sf_Details against the
+RequestedQtyIndex lookup at 1k and 10k credit lines. No gateway calls are made.
+
+    python benchmarks/bench_grouping.py [line_count ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ces_records import ScannedLine, EligibilityResult
+from invoice_index import RequestedQtyIndex
+from validation import group_eligibility_results
+
+LINES_PER_INVOICE = 25
+
+def build_case(line_count):
+    """One sf_Details entry with line_count requests and a matching evaluated result per line"""
+    credit_requests = []
+    results = []
+    for i in range(line_count):
+        invoice_number = f"INV{i // LINES_PER_INVOICE:06d}"
+        supc = f"S{i:07d}"
+        credit_requests.append({'InvoiceNumber': invoice_number, 'SUPC': supc, 'MissingQuantity': str(i % 5 + 1)})
+        scanned_item = ScannedLine({
+            'itemNumber': supc,
+            'quantity': 10,
+            'deliveredItemQty': 8,
+            'rejectedItemQty': 0,
+            'scheduledDeliveryDate': '2025-01-10'
+        })
+        results.append(EligibilityResult(
+            invoice_number, supc, 'Eligible for credit as no previous processed credits has found', True, 'CS',
+            quantity=10, delivered_rejected_sum=8, scanned_item=scanned_item
+        ))
+    return [{'credit_requests': credit_requests}], results
+
+def rescan_requested_qty(sf_Details, results):
+    """The lookup the index replaced: scan every request line for each result"""
+    requested = []
+    for result in results:
+        requested_qty = 0
+        for item in sf_Details:
+            for credit_req in item.get('credit_requests', []):
+                if (credit_req.get('SUPC') == result.supc and
+                    credit_req.get('InvoiceNumber') == result.invoice_number):
+                    try:
+                        requested_qty = int(credit_req.get('MissingQuantity', 0))
+                    except (ValueError, TypeError):
+                        requested_qty = 0
+                    break
+        requested.append(requested_qty)
+    return requested
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    value = fn(*args)
+    return value, (time.perf_counter() - started) * 1000
+
+def run(line_count):
+    sf_Details, results = build_case(line_count)
+
+    rescanned, rescan_ms = timed(rescan_requested_qty, sf_Details, results)
+    requested_index, index_ms = timed(RequestedQtyIndex, sf_Details)
+    grouped, group_ms = timed(group_eligibility_results, [(0, result) for result in results], requested_index)
+
+    indexed = [item['sot_credits_requested'] for group in grouped for item in group['credits_eligibility']]
+    if indexed != rescanned:
+        raise Exception(f"Requested quantities differ between rescan and index at {line_count} lines")
+
+    print(f"{line_count:>6} lines  rescan lookup {rescan_ms:10.1f} ms  index build {index_ms:7.1f} ms  indexed grouping {group_ms:7.1f} ms")
+
+if __name__ == '__main__':
+    for line_count in [int(arg) for arg in sys.argv[1:]] or [1000, 10000]:
+        run(line_count)
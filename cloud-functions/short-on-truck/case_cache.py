@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from state_store import LocalFileStateStore, GcsStateStore
+from settings import get_settings
+
+
+# Snapshots kept by the in-memory backend before the least recently used is evicted
+CASE_CACHE_MAX_ENTRIES = get_settings().case_cache_max_entries
+
+class InMemoryCaseStore:
+    """LRU-bounded process-local snapshot store; only survives while the instance stays warm"""
+
+    def __init__(self, max_entries=CASE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._values:
+                return default
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+def email_set_signature(emails):
+    """Stable digest of a case's EmailMessage set, from each email's Id and CreatedDate"""
+    entries = sorted(f"{email.get('Id')}|{email.get('CreatedDate')}" for email in emails)
+    return hashlib.sha1('\n'.join(entries).encode('utf-8')).hexdigest()
+
+class CaseSnapshotCache:
+    """Formatted case_data per case, with the LastModifiedDate and email-set signature it was built from.
+
+    Any object with get(key, default) and set(key, value) can be the backend,
+    including the state_store classes.
+    """
+
+    def __init__(self, store=None, prefix='case:'):
+        self.store = store if store is not None else InMemoryCaseStore()
+        self.prefix = prefix
+
+    def _key(self, case_id, variant):
+        return f"{self.prefix}{case_id}:{variant}" if variant else f"{self.prefix}{case_id}"
+
+    def get(self, case_id, variant=None):
+        return self.store.get(self._key(case_id, variant))
+
+    def put(self, case_id, case_data, email_signature, variant=None):
+        self.store.set(self._key(case_id, variant), {
+            'last_modified_date': case_data.get('last_modified_date'),
+            'email_signature': email_signature,
+            'case_data': case_data
+        })
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_case_cache():
+    """Get the configured case snapshot cache: CASE_CACHE_BUCKET (GCS), CASE_CACHE_FILE (local JSON) or in-memory"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            settings = get_settings()
+            if settings.case_cache_bucket:
+                store = GcsStateStore(settings.case_cache_bucket, prefix='short-on-truck-cases/')
+            elif settings.case_cache_file:
+                store = LocalFileStateStore(settings.case_cache_file)
+            else:
+                store = InMemoryCaseStore()
+            _default_cache = CaseSnapshotCache(store)
+        return _default_cache
@@ -0,0 +1,58 @@
+from settings import get_settings
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# The only item fields eligibility evaluation reads from CES invoice payloads
+ITEM_FIELDS = frozenset([
+    'itemNumber', 'quantity', 'deliveredItemQty', 'rejectedItemQty', 'scheduledDeliveryDate',
+    'splitCode', 'invoiceRefNumber', 'transCode', 'originalShipQty', 'invoiceDate'
+])
+
+# Stream-parse payloads when ijson is installed; set CES_STREAMING_PARSE=0 to always use response.json()
+STREAMING_PARSE = ijson is not None and get_settings().ces_streaming_parse
+
+def project_item(item, fields=ITEM_FIELDS):
+    return {key: value for key, value in item.items() if key in fields}
+
+def _stream_items(stream, fields):
+    """Read totalItems and projected items from a JSON byte stream without building the full document"""
+    total_items = None
+    items = []
+    item = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if prefix == 'totalItems' and event == 'number':
+            total_items = value
+        elif prefix == 'items.item':
+            if event == 'start_map':
+                item = {}
+            elif event == 'end_map':
+                items.append(item)
+                item = None
+        elif item is not None and prefix.startswith('items.item.') and event not in ('start_map', 'start_array', 'end_map', 'end_array', 'map_key'):
+            key = prefix[len('items.item.'):]
+            if key in fields:
+                item[key] = value
+
+    return {'totalItems': total_items, 'items': items}
+
+def parse_items_payload(response, fields=ITEM_FIELDS):
+    """Parse a CES items payload, keeping only the item fields we use.
+
+    With ijson the body is parsed incrementally from the socket (the request must
+    be made with stream=True), so only the projected items are ever held in memory.
+    Otherwise the body is parsed with response.json() and projected afterwards.
+    """
+    if STREAMING_PARSE:
+        try:
+            response.raw.decode_content = True
+            return _stream_items(response.raw, fields)
+        finally:
+            response.close()
+
+    data = response.json() or {}
+    return {'totalItems': data.get('totalItems'), 'items': [project_item(item, fields) for item in data.get('items') or []]}
@@ -0,0 +1,112 @@
+def _to_int(value, default):
+    """Parse a CES quantity once; None means absent and maps to default"""
+    if value is None:
+        return default
+    return int(value)
+
+class InvoiceLine:
+    """Original invoice line for one SUPC"""
+    __slots__ = ('supc', 'split_code')
+
+    def __init__(self, item):
+        self.supc = item.get('itemNumber')
+        self.split_code = item.get('splitCode')
+
+class ScannedLine:
+    """Scanned (delivery) line for one SUPC, with quantities parsed to int at ingest.
+
+    A line whose quantities cannot be parsed keeps the parse error in error, so it
+    is only reported if that SUPC is actually requested.
+    """
+    __slots__ = ('supc', 'quantity', 'delivered_qty', 'rejected_qty', 'scheduled_delivery_date', 'error')
+
+    def __init__(self, item):
+        self.supc = item.get('itemNumber')
+        self.scheduled_delivery_date = item.get('scheduledDeliveryDate')
+        self.error = None
+        try:
+            self.quantity = _to_int(item.get('quantity'), None)
+            self.delivered_qty = _to_int(item.get('deliveredItemQty'), 0)
+            self.rejected_qty = _to_int(item.get('rejectedItemQty'), 0)
+        except (ValueError, TypeError) as e:
+            self.quantity = self.delivered_qty = self.rejected_qty = None
+            self.error = str(e)
+
+    def as_dict(self):
+        return {
+            'itemNumber': self.supc,
+            'quantity': self.quantity,
+            'deliveredItemQty': self.delivered_qty,
+            'rejectedItemQty': self.rejected_qty,
+            'scheduledDeliveryDate': self.scheduled_delivery_date
+        }
+
+class CreditLine:
+    """Prior credit ('C') line from customer extended details"""
+    __slots__ = ('invoice_ref_number', 'supc', 'original_ship_qty', 'invoice_date', 'error')
+
+    def __init__(self, item):
+        self.invoice_ref_number = item.get('invoiceRefNumber')
+        self.supc = item.get('itemNumber')
+        self.invoice_date = item.get('invoiceDate')
+        self.error = None
+        ship_qty = item.get('originalShipQty', 0)
+        try:
+            self.original_ship_qty = _to_int(ship_qty, 0)
+        except (ValueError, TypeError):
+            self.original_ship_qty = None
+            self.error = f"Invalid originalShipQty format: {ship_qty}"
+
+    def as_dict(self):
+        return {
+            'invoiceRefNumber': self.invoice_ref_number,
+            'itemNumber': self.supc,
+            'originalShipQty': self.original_ship_qty
+        }
+
+class PendingCredit:
+    """A line that passed the delivery checks and needs the customer's prior credits to be decided"""
+    __slots__ = ('invoice_number', 'supc', 'split_code', 'scanned_item', 'delivery_date')
+
+    def __init__(self, invoice_number, supc, split_code, scanned_item, delivery_date):
+        self.invoice_number = invoice_number
+        self.supc = supc
+        self.split_code = split_code
+        self.scanned_item = scanned_item
+        self.delivery_date = delivery_date
+
+class EligibilityResult:
+    """Outcome of evaluating one (invoice, SUPC) credit line.
+
+    scanned_item is the ScannedLine the decision was based on and invoice_item the
+    matching prior CreditLine, when there is one.
+    """
+    __slots__ = (
+        'invoice_number', 'supc', 'status', 'eligible', 'split_code', 'quantity', 'delivered_rejected_sum',
+        'scanned_difference', 'original_ship_qty', 'scanned_item', 'invoice_item'
+    )
+
+    def __init__(self, invoice_number, supc, status, eligible, split_code=None, quantity=None, delivered_rejected_sum=None,
+                 scanned_difference=None, original_ship_qty=None, scanned_item=None, invoice_item=None):
+        self.invoice_number = invoice_number
+        self.supc = supc
+        self.status = status
+        self.eligible = eligible
+        self.split_code = split_code
+        self.quantity = quantity
+        self.delivered_rejected_sum = delivered_rejected_sum
+        self.scanned_difference = scanned_difference
+        self.original_ship_qty = original_ship_qty
+        self.scanned_item = scanned_item
+        self.invoice_item = invoice_item
+
+    def debug_dict(self):
+        """Intermediate evaluation values and source lines, for the full output profile"""
+        return {
+            'quantity': self.quantity,
+            'delivered_rejected_sum': self.delivered_rejected_sum,
+            'scanned_difference': self.scanned_difference,
+            'original_ship_qty': self.original_ship_qty,
+            'scanned_item': self.scanned_item.as_dict() if self.scanned_item else None,
+            'invoice_item': self.invoice_item.as_dict() if self.invoice_item else None
+        }
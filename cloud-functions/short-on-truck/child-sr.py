@@ -1,25 +1,7 @@
-import os
-import requests
 import functions_framework
-from dotenv import load_dotenv
-load_dotenv()
+from token_cache import get_oauth_token, authorized_request
+from settings import get_settings
 
-def get_oauth_token():
-    """Get OAuth token using client credentials via API gateway"""
-    token_url = f"{os.getenv('GATEWAY_URL')}/token"
-    
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': os.getenv('CLIENT_ID'),
-        'client_secret': os.getenv('CLIENT_SECRET')
-    }
-    
-    response = requests.post(token_url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to get token: {response.text}")
 
 @functions_framework.http
 def childsr_handler(request):
@@ -47,8 +29,8 @@ def childsr_handler(request):
             "Status": "Completed"
         }
         
-        case_url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Case/{case_id}"
-        sf_response = requests.patch(case_url, headers=headers, json=sf_payload)
+        case_url = f"{get_settings().crm_url}/sobjects/Case/{case_id}"
+        sf_response = authorized_request('PATCH', case_url, headers=headers, json=sf_payload)
         
         if sf_response.status_code == 200:
             return {"success": True, "case_id": case_id, "status": "Completed"}
@@ -0,0 +1,149 @@
+import json
+import time
+import sqlite3
+import threading
+from settings import get_settings
+
+# How long a dispatched case counts as having a live execution
+DEFAULT_TTL_SECONDS = get_settings().dispatch_ledger_ttl_seconds
+
+class InMemoryDispatchLedger:
+    """Case id -> expiry of its live workflow execution, held in process memory"""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def claim(self, case_id):
+        """Reserve case_id for dispatch; False if it already has a live execution"""
+        now = self._clock()
+        with self._lock:
+            if self._expiry.get(case_id, 0) > now:
+                return False
+            self._expiry[case_id] = now + self.ttl_seconds
+            return True
+
+    def release(self, case_id):
+        """Forget a claim whose dispatch failed so the case can be retried"""
+        with self._lock:
+            self._expiry.pop(case_id, None)
+
+class SqliteDispatchLedger:
+    """Dispatch ledger in a SQLite file, shared by every process on the same disk"""
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS dispatch_ledger (case_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def claim(self, case_id):
+        """Reserve case_id for dispatch; False if it already has a live execution"""
+        now = self._clock()
+        with self._lock:
+            conn = self._connect()
+            try:
+                # IMMEDIATE takes the write lock up front, so two processes cannot both claim a case
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT expires_at FROM dispatch_ledger WHERE case_id = ?", (case_id,)).fetchone()
+                if row and row[0] > now:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute("INSERT OR REPLACE INTO dispatch_ledger (case_id, expires_at) VALUES (?, ?)", (case_id, now + self.ttl_seconds))
+                conn.execute("COMMIT")
+                return True
+            finally:
+                conn.close()
+
+    def release(self, case_id):
+        """Forget a claim whose dispatch failed so the case can be retried"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM dispatch_ledger WHERE case_id = ?", (case_id,))
+            finally:
+                conn.close()
+
+class GcsDispatchLedger:
+    """Dispatch ledger kept as one object per case in a Cloud Storage bucket, shared by every instance.
+
+    Claims use generation preconditions: a new claim only succeeds if no object
+    exists, and an expired claim is only taken over if nobody replaced it since
+    it was read, so two instances never both claim a case.
+    """
+
+    def __init__(self, bucket_name, prefix='short-on-truck-dispatch/', ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.time, bucket=None):
+        if bucket is None:
+            from google.cloud import storage
+            bucket = storage.Client().bucket(bucket_name)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+
+    def _write(self, blob, expires_at, generation):
+        blob.upload_from_string(json.dumps({'expires_at': expires_at}), content_type='application/json', if_generation_match=generation)
+
+    def claim(self, case_id):
+        """Reserve case_id for dispatch; False if it already has a live execution"""
+        from google.api_core.exceptions import PreconditionFailed, NotFound
+        name = f"{self.prefix}{case_id}.json"
+        now = self._clock()
+        # A claim released between our write and read is retried once as a fresh claim
+        for _ in range(2):
+            try:
+                self._write(self.bucket.blob(name), now + self.ttl_seconds, 0)
+                return True
+            except PreconditionFailed:
+                pass
+
+            blob = self.bucket.get_blob(name)
+            if blob is None:
+                continue
+            try:
+                expires_at = json.loads(blob.download_as_text(if_generation_match=blob.generation))['expires_at']
+            except (PreconditionFailed, NotFound):
+                continue
+            if expires_at > now:
+                return False
+            try:
+                self._write(blob, now + self.ttl_seconds, blob.generation)
+                return True
+            except PreconditionFailed:
+                return False
+        return False
+
+    def release(self, case_id):
+        """Forget a claim whose dispatch failed so the case can be retried"""
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(f"{self.prefix}{case_id}.json").delete()
+        except NotFound:
+            pass
+
+_default_ledger = None
+_default_ledger_lock = threading.Lock()
+
+def get_dispatch_ledger():
+    """Get the configured ledger: DISPATCH_LEDGER_BUCKET (GCS, defaulting to STATE_BUCKET), SQLite at DISPATCH_LEDGER_PATH, otherwise in-memory.
+
+    Only the GCS ledger is shared across Cloud Function instances; the SQLite
+    and in-memory ledgers are for local runs and tests.
+    """
+    global _default_ledger
+    with _default_ledger_lock:
+        if _default_ledger is None:
+            if get_settings().dispatch_ledger_bucket:
+                _default_ledger = GcsDispatchLedger(get_settings().dispatch_ledger_bucket)
+            elif get_settings().dispatch_ledger_path:
+                _default_ledger = SqliteDispatchLedger(get_settings().dispatch_ledger_path)
+            else:
+                _default_ledger = InMemoryDispatchLedger()
+        return _default_ledger
@@ -0,0 +1,125 @@
+import re
+import hashlib
+
+# A line that starts the quoted history of a reply; everything from it on is dropped
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^\s*On .{1,200}wrote:\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-{2,}\s*Original Message\s*-{2,}', re.IGNORECASE),
+    re.compile(r'^\s*_{10,}\s*$'),
+    re.compile(r'^\s*From:\s.+$', re.IGNORECASE)
+]
+
+# A forwarded message is usually the customer's actual request, so it is always kept verbatim
+FORWARD_HEADER_PATTERN = re.compile(r'^\s*-{2,}\s*Forwarded Message\s*-{2,}', re.IGNORECASE)
+
+# Signature delimiter; everything from the line on is dropped
+SIGNATURE_DELIMITER_PATTERN = re.compile(r'^-- ?$')
+
+# Mobile footers; dropped with the lines below them only when those look like a signature too
+MOBILE_FOOTER_PATTERN = re.compile(r'^\s*Sent from my \w+', re.IGNORECASE)
+
+# Sign-offs only count as a signature start this close to the end of the remaining text,
+# and only when the block below looks like a name and title rather than more of the request
+SIGN_OFF_PATTERN = re.compile(r'^\s*(thanks|thank you|regards|best regards|kind regards|best|cheers|sincerely)[,.!]?\s*$', re.IGNORECASE)
+SIGN_OFF_MAX_TAIL_LINES = 6
+SIGN_OFF_MAX_BLOCK_LINES = 3
+SIGN_OFF_MAX_LINE_CHARS = 40
+
+def _is_outlook_header(lines, i):
+    """A From: line only starts quoted history when a Sent:/Date: header follows it"""
+    for line in lines[i + 1:i + 4]:
+        if re.match(r'^\s*(Sent|Date):\s', line, re.IGNORECASE):
+            return True
+    return False
+
+def _forward_start(lines):
+    """Index of the first forwarded-message header, or len(lines) when there is none"""
+    return next((i for i, line in enumerate(lines) if FORWARD_HEADER_PATTERN.match(line)), len(lines))
+
+def _is_sign_off_block(lines):
+    """True when the lines below a sign-off are only a short name/title block.
+
+    Digits (account, invoice or phone numbers), sentence punctuation or long
+    lines mean the customer kept writing, so the block is kept.
+    """
+    block = [line.strip() for line in lines if line.strip()]
+    if len(block) > SIGN_OFF_MAX_BLOCK_LINES:
+        return False
+    for line in block:
+        if len(line) > SIGN_OFF_MAX_LINE_CHARS or line[-1] in '.?!:' or any(ch.isdigit() for ch in line):
+            return False
+    return True
+
+def strip_quoted_reply(text):
+    """Drop the quoted history below a reply header and any '>'-quoted lines; forwarded messages are kept"""
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        if FORWARD_HEADER_PATTERN.match(line):
+            kept.extend(lines[i:])
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        header = next((pattern for pattern in QUOTE_HEADER_PATTERNS if pattern.match(line)), None)
+        if header is not None and (header is not QUOTE_HEADER_PATTERNS[-1] or _is_outlook_header(lines, i)):
+            break
+        kept.append(line)
+    return '\n'.join(kept)
+
+def strip_signature(text):
+    """Drop a trailing signature block above any forwarded message"""
+    lines = text.splitlines()
+    forward_start = _forward_start(lines)
+    lines, forwarded = lines[:forward_start], lines[forward_start:]
+    for i, line in enumerate(lines):
+        if SIGNATURE_DELIMITER_PATTERN.match(line) or (MOBILE_FOOTER_PATTERN.match(line) and _is_sign_off_block(lines[i + 1:])):
+            lines = lines[:i]
+            break
+
+    tail_start = max(len(lines) - SIGN_OFF_MAX_TAIL_LINES, 0)
+    for i in range(tail_start, len(lines)):
+        if SIGN_OFF_PATTERN.match(lines[i]) and _is_sign_off_block(lines[i + 1:]):
+            lines = lines[:i]
+            break
+    return '\n'.join(lines + forwarded)
+
+def compact_text(text):
+    """Email body without quoted replies, signature or surrounding blank lines"""
+    if not text:
+        return text or ''
+    return strip_signature(strip_quoted_reply(text)).strip()
+
+def _body_signature(text):
+    return hashlib.sha1(' '.join(text.split()).lower().encode('utf-8')).hexdigest()
+
+def _size(text):
+    return len((text or '').encode('utf-8'))
+
+def compact_emails(emails, body_key='text_body'):
+    """Compact each email body and drop emails whose compacted body repeats an earlier one.
+
+    Returns the kept emails (as copies) and byte counts before and after compaction.
+    """
+    kept = []
+    seen = set()
+    original_bytes = 0
+    compacted_bytes = 0
+    for email in emails:
+        original = email.get(body_key) or ''
+        original_bytes += _size(original)
+
+        compacted = compact_text(original)
+        signature = _body_signature(compacted)
+        if compacted and signature in seen:
+            continue
+        seen.add(signature)
+
+        compacted_bytes += _size(compacted)
+        kept.append(dict(email, **{body_key: compacted}))
+
+    stats = {
+        'original_bytes': original_bytes,
+        'compacted_bytes': compacted_bytes,
+        'duplicates_dropped': len(emails) - len(kept)
+    }
+    return kept, stats
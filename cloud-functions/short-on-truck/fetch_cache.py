@@ -0,0 +1,55 @@
+import threading
+
+class FetchCache:
+    """Request-scoped memo of gateway fetches, so each resource is fetched at most once per run.
+
+    Safe to share between worker threads: concurrent callers asking for the same
+    key wait for the first caller's fetch instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._derived = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _memo(self, store, key, load, counted):
+        with self._lock:
+            if key in store:
+                if counted:
+                    self.hits += 1
+                return store[key]
+            key_lock = self._key_locks.setdefault((id(store), key), threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in store:
+                    if counted:
+                        self.hits += 1
+                    return store[key]
+                if counted:
+                    self.misses += 1
+            value = load()
+            with self._lock:
+                store[key] = value
+            return value
+
+    def get_or_fetch(self, key, fetch):
+        """Return the cached value for key, calling fetch() on first use"""
+        return self._memo(self._entries, key, fetch, True)
+
+    def get_or_build(self, key, build):
+        """Memoize a value derived from fetched data (e.g. an index) without touching the fetch counters"""
+        return self._memo(self._derived, key, build, False)
+
+    def prime(self, key, value):
+        """Seed a fetched value obtained some other way (e.g. from a batched request)"""
+        with self._lock:
+            self._entries.setdefault(key, value)
+
+    def stats(self):
+        """Hit/miss counters for response metadata"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -1,25 +1,27 @@
-import os
-import requests
+import json
 import functions_framework
-from dotenv import load_dotenv
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response
+from token_cache import get_oauth_token, authorized_request
+from sf_query import iter_query_records, query_records
+from email_compaction import compact_emails
+from case_cache import get_case_cache, email_set_signature
+from settings import get_settings
 
-def get_oauth_token():
-    """Get OAuth token using client credentials via API gateway"""
-    token_url = f"{os.getenv('GATEWAY_URL')}/token"
-    
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': os.getenv('CLIENT_ID'),
-        'client_secret': os.getenv('CLIENT_SECRET')
-    }
-    
-    response = requests.post(token_url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to get token: {response.text}")
+
+# Shared pool for the concurrent status update, case and email calls; kept across warm invocations
+CASE_DETAILS_MAX_WORKERS = get_settings().case_details_max_workers
+_executor = ThreadPoolExecutor(max_workers=CASE_DETAILS_MAX_WORKERS)
+
+# Newest emails returned per case (0 returns all) and the page size requested from Salesforce
+EMAIL_MAX_MESSAGES = get_settings().email_max_messages
+EMAIL_PAGE_SIZE = get_settings().email_page_size
+
+# Strip quoted replies/signatures and drop duplicate bodies unless the request says otherwise
+EMAIL_COMPACTION = get_settings().email_compaction
+
+# Reuse stored case snapshots when the case and its emails are unchanged; CASE_CACHE=0 always re-pulls
+CASE_CACHE_ENABLED = get_settings().case_cache_enabled
 
 def update_case_status(case_id, access_token):
     """Update case status to In Progress"""
@@ -28,16 +30,209 @@ def update_case_status(case_id, access_token):
         'Content-Type': 'application/json'
     }
     
-    update_url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Case/{case_id}"
+    update_url = f"{get_settings().crm_url}/sobjects/Case/{case_id}"
     update_data = {"Status": "In Progress"}
     
-    response = requests.patch(update_url, headers=headers, json=update_data)
+    response = authorized_request('PATCH', update_url, headers=headers, json=update_data)
     if response.status_code not in [200, 204]:
         raise Exception(f"Failed to update case status: {response.text}")
 
+def fetch_case(case_id, headers):
+    """Get the Case record via API gateway"""
+    case_url = f"{get_settings().crm_url}/sobjects/Case/{case_id}"
+    return authorized_request('GET', case_url, headers=headers)
+
+def email_query_url():
+    return f"{get_settings().crm_url}/sobjects/EmailMessage/query"
+
+def fetch_email_index(case_id, headers):
+    """Id and CreatedDate of every email on the case, following query pagination"""
+    params = {'fields': 'Id, CreatedDate', 'filters': f"ParentId='{case_id}'"}
+    return list(iter_query_records(email_query_url(), params, headers, page_size=EMAIL_PAGE_SIZE))
+
+def fetch_emails(case_id, headers, max_messages=None, index=None):
+    """Get the case's newest email messages via API gateway, following query pagination.
+
+    With a limit and no index given, the bodies are queried directly and the
+    first max_messages + 1 rows decide whether the case fits within the limit,
+    so a small case costs one query. A larger case (or an index given) pages
+    through Id/CreatedDate only and then fetches the bodies of the newest
+    max_messages emails alone. totalSize is always the case's full email count
+    and index lists every email's Id/CreatedDate. Empty when a query fails.
+    """
+    if max_messages is None:
+        max_messages = EMAIL_MAX_MESSAGES
+    fields = "Id, Subject, FromAddress, FromName, ToAddress, TextBody, CreatedDate"
+    filters = f"ParentId='{case_id}'"
+    
+    try:
+        records = None
+        if max_messages > 0 and index is None:
+            # The probe never needs more than max_messages + 1 rows, so it asks for no bigger a page
+            probe_page_size = min(EMAIL_PAGE_SIZE, max_messages + 1)
+            records = list(iter_query_records(email_query_url(), {'fields': fields, 'filters': filters}, headers, page_size=probe_page_size, max_records=max_messages + 1))
+            if len(records) > max_messages:
+                records = None
+                index = fetch_email_index(case_id, headers)
+        
+        if records is None:
+            if index is not None and len(index) > max_messages > 0:
+                newest = sorted(index, key=lambda email: email.get('CreatedDate') or '', reverse=True)[:max_messages]
+                id_list = ', '.join(f"'{email['Id']}'" for email in newest)
+                filters = f"{filters} AND Id IN ({id_list})"
+            records = list(iter_query_records(email_query_url(), {'fields': fields, 'filters': filters}, headers, page_size=EMAIL_PAGE_SIZE))
+    except Exception:
+        return {'totalSize': 0, 'records': [], 'index': []}
+    
+    if index is None:
+        index = [{'Id': email.get('Id'), 'CreatedDate': email.get('CreatedDate')} for email in records]
+    return {'totalSize': len(index), 'records': records, 'index': index}
+
+def format_case(case):
+    """Project a Case record to the case_data shape, without emails"""
+    return {
+        'id': case['Id'],
+        'case_number': case.get('CaseNumber', ''),
+        'subject': case.get('Subject', ''),
+        'description': case.get('Description', ''),
+        'status': case.get('Status', ''),
+        'priority': case.get('Priority', ''),
+        'type': case.get('Type', ''),
+        'origin': case.get('Origin', ''),
+        'created_date': case.get('CreatedDate', ''),
+        'Account_ID__c':case.get('Account_ID__c',''),
+        'last_modified_date': case.get('LastModifiedDate', ''),
+        'closed_date': case.get('ClosedDate', ''),
+        'is_closed': case.get('IsClosed', False),
+        'account_name': '',
+        'contact_name': '',
+        'contact_email': case.get('ContactEmail', ''),
+        'owner_name': '',
+        'owner_type': ''
+    }
+
+def format_email(email):
+    """Project an EmailMessage record to the email_messages shape"""
+    return {
+        'id': email['Id'],
+        'subject': email.get('Subject', ''),
+        'from_address': email.get('FromAddress', ''),
+        'from_name': email.get('FromName', ''),
+        'to_address': email.get('ToAddress', ''),
+        'text_body': email.get('TextBody', ''),
+        'created_date': email.get('CreatedDate', '')
+    }
+
+def format_emails(emails, compaction):
+    """email_messages for the case, compacted when requested, with the email_stats that go with them"""
+    email_messages = [format_email(email) for email in emails.get('records', [])]
+    email_stats = {'total': emails.get('totalSize', 0), 'fetched': len(email_messages)}
+    if compaction:
+        email_messages, compaction_stats = compact_emails(email_messages)
+        email_stats.update(compaction_stats)
+    email_stats['returned'] = len(email_messages)
+    return email_messages, email_stats
+
+def start_case_fetch(case_id, access_token, headers, max_messages):
+    """Issue the status update, case and email calls concurrently.
+
+    Returns the case projection and the pending email fetch once the status update
+    is confirmed, or an error body and None when the case could not be read.
+    """
+    # None of the three calls depends on another once the token is in hand
+    status_future = _executor.submit(update_case_status, case_id, access_token)
+    case_future = _executor.submit(fetch_case, case_id, headers)
+    emails_future = _executor.submit(fetch_emails, case_id, headers, max_messages)
+    
+    # The status update is still confirmed before anything is returned
+    status_future.result()
+    
+    case_response = case_future.result()
+    if case_response.status_code != 200:
+        return {"error": f"Failed to get case: {case_response.text}"}, None
+    
+    # The case read may race the update, so report the status that was just confirmed
+    case_data = format_case(case_response.json())
+    case_data['status'] = 'In Progress'
+    return case_data, emails_future
+
+def fetch_case_data(case_id, access_token, headers, max_messages, compaction):
+    """Pull the case and its emails, returning the case_data and the email-set signature it was built from"""
+    case_data, emails_future = start_case_fetch(case_id, access_token, headers, max_messages)
+    if emails_future is None:
+        return case_data, None
+    
+    emails = emails_future.result()
+    case_data['email_messages'], case_data['email_stats'] = format_emails(emails, compaction)
+    case_data['email_count'] = emails.get('totalSize', 0)
+    return case_data, email_set_signature(emails['index'])
+
+def refresh_case_data(case_id, access_token, headers, snapshot, max_messages, compaction):
+    """Rebuild case_data from a snapshot, re-pulling only the parts that changed since it was taken.
+
+    A field-projected Case read and the email Id/CreatedDate index decide what
+    changed. The status update is skipped when the case is already In Progress,
+    so repeated fetches leave LastModifiedDate alone. Returns the case_data, its
+    email-set signature and which parts were re-pulled, or None if the case was
+    not found.
+    """
+    meta_future = _executor.submit(query_records, 'Case', 'Id, Status, LastModifiedDate', f"Id='{case_id}'", headers)
+    index_future = _executor.submit(fetch_email_index, case_id, headers)
+    records = meta_future.result().get('records', [])
+    email_index = index_future.result()
+    if not records:
+        return None
+    
+    email_signature = email_set_signature(email_index)
+    emails_changed = email_signature != snapshot.get('email_signature')
+    emails_future = _executor.submit(fetch_emails, case_id, headers, max_messages, email_index) if emails_changed else None
+    
+    case_changed = records[0].get('LastModifiedDate') != snapshot.get('last_modified_date')
+    if records[0].get('Status') != 'In Progress':
+        # The update moves LastModifiedDate, so the case is read again after it
+        update_case_status(case_id, access_token)
+        case_changed = True
+    
+    case_data = dict(snapshot['case_data'])
+    if case_changed:
+        case_response = fetch_case(case_id, headers)
+        if case_response.status_code != 200:
+            raise Exception(f"Failed to get case: {case_response.text}")
+        case_data.update(format_case(case_response.json()))
+    
+    if emails_future is not None:
+        emails = emails_future.result()
+        case_data['email_messages'], case_data['email_stats'] = format_emails(emails, compaction)
+        case_data['email_count'] = emails.get('totalSize', 0)
+    
+    return case_data, email_signature, {'case': case_changed, 'emails': emails_changed}
+
+def stream_case_details(case_data, emails_future, compaction):
+    """NDJSON body: the case projection first, then one line per email once the query returns"""
+    yield json.dumps({'type': 'case', 'data': case_data}) + '\n'
+    try:
+        emails = emails_future.result()
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        return
+    email_messages, email_stats = format_emails(emails, compaction)
+    for email_data in email_messages:
+        yield json.dumps({'type': 'email', 'data': email_data}) + '\n'
+    yield json.dumps({'type': 'end', 'email_count': emails.get('totalSize', 0), 'email_stats': email_stats}) + '\n'
+
 @functions_framework.http
 def get_case_details(request):
-    """HTTP Cloud Function to get case details from Salesforce by case ID using OAuth"""
+    """HTTP Cloud Function to get case details from Salesforce by case ID using OAuth.
+
+    The status update, case and email calls are issued concurrently. With
+    stream_emails set, the response is NDJSON and the case projection is sent
+    before the emails arrive. max_emails and compact_emails override the
+    configured newest-N limit and compaction.
+    
+    Non-streamed results are kept as case snapshots; a later fetch of the same
+    case first checks LastModifiedDate and the email set and only re-pulls what
+    changed. refresh skips the snapshot.
+    """
     try:
         request_json = request.get_json(silent=True)
         if not request_json:
@@ -49,76 +244,52 @@ def get_case_details(request):
         if not case_id:
             return {"error": "No case_id provided"}, 400
         
+        try:
+            max_messages = int(request_json.get('max_emails', EMAIL_MAX_MESSAGES))
+        except (ValueError, TypeError):
+            return {"error": "max_emails must be an integer"}, 400
+        compaction = request_json.get('compact_emails', EMAIL_COMPACTION)
+        
         # Get OAuth token
         token_response = get_oauth_token()
         access_token = token_response['access_token']
         
-        # Update case status to In Progress
-        update_case_status(case_id, access_token)
-        
         headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
         
-        # Get case details via API gateway
-        case_url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Case/{case_id}"
-        case_response = requests.get(case_url, headers=headers)
-        
-        if case_response.status_code != 200:
-            return {"error": f"Failed to get case: {case_response.text}"}
-        
-        case = case_response.json()
+        if request_json.get('stream_emails'):
+            case_data, emails_future = start_case_fetch(case_id, access_token, headers, max_messages)
+            if emails_future is None:
+                return case_data
+            return Response(stream_case_details(case_data, emails_future, compaction), mimetype='application/x-ndjson')
         
-        # Get email messages via API gateway
-        fields = "Id, Subject, FromAddress, FromName, ToAddress, TextBody, CreatedDate"
-        email_url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/EmailMessage/query"
-        params = {
-            'fields': fields,
-            'filters': f"ParentId='{case_id}'"
-        }
-        email_response = requests.get(email_url, headers=headers, params=params)
+        case_cache = get_case_cache() if CASE_CACHE_ENABLED else None
+        variant = f"{max_messages}:{int(bool(compaction))}"
+        snapshot = case_cache.get(case_id, variant) if case_cache and not request_json.get('refresh') else None
         
-        emails = email_response.json() if email_response.status_code == 200 else {'totalSize': 0, 'records': []}
+        refreshed = None
+        if snapshot:
+            try:
+                refreshed = refresh_case_data(case_id, access_token, headers, snapshot, max_messages, compaction)
+            except Exception:
+                # Any failure in the conditional path falls back to a full pull
+                refreshed = None
         
-        # Format case data
-        case_data = {
-            'id': case['Id'],
-            'case_number': case.get('CaseNumber', ''),
-            'subject': case.get('Subject', ''),
-            'description': case.get('Description', ''),
-            'status': case.get('Status', ''),
-            'priority': case.get('Priority', ''),
-            'type': case.get('Type', ''),
-            'origin': case.get('Origin', ''),
-            'created_date': case.get('CreatedDate', ''),
-            'Account_ID__c':case.get('Account_ID__c',''),
-            'last_modified_date': case.get('LastModifiedDate', ''),
-            'closed_date': case.get('ClosedDate', ''),
-            'is_closed': case.get('IsClosed', False),
-            'account_name': '',
-            'contact_name': '',
-            'contact_email': case.get('ContactEmail', ''),
-            'owner_name': '',
-            'owner_type': '',
-            'email_messages': [],
-            'email_count': emails.get('totalSize', 0)
-        }
+        if refreshed:
+            case_data, email_signature, changed = refreshed
+            case_data['snapshot'] = 'refreshed' if changed['case'] or changed['emails'] else 'unchanged'
+        else:
+            case_data, email_signature = fetch_case_data(case_id, access_token, headers, max_messages, compaction)
+            if email_signature is None:
+                return case_data
+            case_data['snapshot'] = 'miss'
         
-        # Add email messages
-        for email in emails.get('records', []):
-            email_data = {
-                'id': email['Id'],
-                'subject': email.get('Subject', ''),
-                'from_address': email.get('FromAddress', ''),
-                'from_name': email.get('FromName', ''),
-                'to_address': email.get('ToAddress', ''),
-                'text_body': email.get('TextBody', ''),
-                'created_date': email.get('CreatedDate', '')
-            }
-            case_data['email_messages'].append(email_data)
+        if case_cache:
+            case_cache.put(case_id, {key: value for key, value in case_data.items() if key != 'snapshot'}, email_signature, variant)
         
         return case_data
         
     except Exception as e:
-        return {"error": str(e)}, 500
\ No newline at end of file
+        return {"error": str(e)}, 500
@@ -0,0 +1,59 @@
+import threading
+from urllib.parse import urlsplit
+from settings import get_settings
+
+
+POOL_SIZE = get_settings().http_pool_size
+CONNECT_TIMEOUT = get_settings().http_connect_timeout
+READ_TIMEOUT = get_settings().http_read_timeout
+MAX_RETRIES = get_settings().http_max_retries
+BACKOFF_FACTOR = get_settings().http_backoff_factor
+
+# Gateway responses worth retrying; Retry-After is honoured on 429/503
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Every gateway call we make is safe to repeat: token grants, queries and status PATCHes
+RETRY_METHODS = frozenset(['GET', 'POST', 'PATCH'])
+
+# host -> requests.Session, kept for the lifetime of the container
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _build_session():
+    """Create a pooled keep-alive session with retry-with-backoff"""
+    # requests is imported on first use so it stays off the cold-start path of every handler
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session(url):
+    """Get the shared session for the host serving url"""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _sessions[host] = _build_session()
+    return session
+
+def request(method, url, timeout=None, **kwargs):
+    """Send a request over the pooled session for url, with default connect/read timeouts"""
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return get_session(url).request(method, url, timeout=timeout, **kwargs)
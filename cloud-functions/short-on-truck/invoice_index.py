@@ -0,0 +1,77 @@
+import re
+from ces_records import InvoiceLine, CreditLine
+
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+class InvoiceIndex:
+    """SUPC -> line record over a CES invoice or delivery payload, built once per payload"""
+
+    def __init__(self, payload, line_type=InvoiceLine):
+        self.items_by_supc = {}
+        for item in (payload or {}).get('items', []) or []:
+            supc = item.get('itemNumber')
+            # First occurrence wins, matching the linear scan it replaces
+            if supc not in self.items_by_supc:
+                self.items_by_supc[supc] = line_type(item)
+
+    def get(self, supc):
+        return self.items_by_supc.get(supc)
+
+class CreditHistoryIndex:
+    """(invoiceRefNumber, SUPC) -> prior credit ('C') lines from customer extended details, built once per payload.
+
+    Built for a customer's widest history window; get(since=...) narrows it to a
+    later window by invoiceDate. dated is False when any credit line lacks an ISO
+    invoiceDate, and such an index must not be narrowed.
+    """
+
+    def __init__(self, payload):
+        self.credits = {}
+        self.dated = True
+        for item in (payload or {}).get('items', []) or []:
+            if item.get('transCode') == 'C':
+                line = CreditLine(item)
+                if not isinstance(line.invoice_date, str) or not ISO_DATE.match(line.invoice_date):
+                    self.dated = False
+                self.credits.setdefault((line.invoice_ref_number, line.supc), []).append(line)
+
+    def get(self, invoice_number, supc, since=None):
+        lines = self.credits.get((invoice_number, supc), [])
+        if since is None:
+            return lines
+        return [line for line in lines if line.invoice_date[:10] >= since]
+
+class RequestedQtyIndex:
+    """(InvoiceNumber, SUPC) -> requested MissingQuantity per sf_Details entry, built once at ingest.
+
+    The reported quantity is the first matching line within the entry, with
+    unparseable quantities counted as 0. Duplicate lines for the same key are
+    aggregated across all entries into a line count and total for debugging output.
+    """
+
+    def __init__(self, sf_Details):
+        self.requested = {}
+        self.line_counts = {}
+        self.totals = {}
+        for position, entry in enumerate(sf_Details or []):
+            if not isinstance(entry, dict):
+                continue
+            for credit_req in entry.get('credit_requests', []) or []:
+                if not isinstance(credit_req, dict):
+                    continue
+                key = (credit_req.get('InvoiceNumber'), credit_req.get('SUPC'))
+                try:
+                    requested_qty = int(credit_req.get('MissingQuantity', 0))
+                except (ValueError, TypeError):
+                    requested_qty = 0
+                self.requested.setdefault((position,) + key, requested_qty)
+                self.line_counts[key] = self.line_counts.get(key, 0) + 1
+                self.totals[key] = self.totals.get(key, 0) + requested_qty
+
+    def get(self, invoice_number, supc, position=0):
+        return self.requested.get((position, invoice_number, supc), 0)
+
+    def aggregate(self, invoice_number, supc):
+        """Line count and summed quantity over every request line for the key"""
+        key = (invoice_number, supc)
+        return {'lines': self.line_counts.get(key, 0), 'total': self.totals.get(key, 0)}
@@ -0,0 +1,85 @@
+import time
+import threading
+from sf_query import iter_query_records
+from settings import get_settings
+
+
+# Seconds between background reloads of the OpCo table, and before retrying a failed load
+REFRESH_INTERVAL = get_settings().opco_registry_refresh_seconds
+RETRY_INTERVAL = get_settings().opco_registry_retry_seconds
+
+def load_opco_ids():
+    """Bulk-load every OpCo_ID__c in one (paginated) query"""
+    url = f"{get_settings().crm_url}/sobjects/OpCo__c/query"
+    params = {'fields': 'OpCo_ID__c', 'filters': "OpCo_ID__c != null"}
+    headers = {'accept': 'application/json'}
+    return frozenset(record['OpCo_ID__c'] for record in iter_query_records(url, params, headers))
+
+class OpcoRegistry:
+    """In-memory set of valid OpCo ids, loaded on first use and refreshed in the background.
+
+    contains() answers True/False from memory, or None while the registry is
+    unavailable so callers can fall back to a live query.
+    """
+
+    def __init__(self, load=load_opco_ids, refresh_interval=REFRESH_INTERVAL, retry_interval=RETRY_INTERVAL, clock=time.monotonic):
+        self._load = load
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._opco_ids = None
+        self._loaded_at = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _reload(self):
+        try:
+            opco_ids = self._load()
+        except Exception:
+            self._failed_at = self._clock()
+            return False
+        self._opco_ids = opco_ids
+        self._loaded_at = self._clock()
+        self._failed_at = None
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self._reload()
+        finally:
+            self._refreshing = False
+
+    def ensure_loaded(self):
+        """Load the registry if needed; stale data is served while a background thread reloads it"""
+        now = self._clock()
+        if self._opco_ids is None:
+            with self._lock:
+                if self._opco_ids is None:
+                    if self._failed_at is not None and now - self._failed_at < self.retry_interval:
+                        return False
+                    return self._reload()
+            return True
+
+        if now - self._loaded_at >= self.refresh_interval and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return True
+
+    def contains(self, opco_id):
+        if not self.ensure_loaded():
+            return None
+        return opco_id in self._opco_ids
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_opco_registry():
+    """Get the container-wide OpCo registry"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = OpcoRegistry()
+        return _default_registry
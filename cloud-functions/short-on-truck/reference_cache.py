@@ -0,0 +1,171 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from settings import get_settings
+
+
+# Returned by loaders (and the cache) for a lookup that genuinely found nothing
+NOT_FOUND = object()
+
+# Per-entity TTLs in seconds; OpCo validity changes roughly monthly, accounts more often
+ENTITY_TTLS = {
+    'opco': get_settings().reference_ttl_opco,
+    'account': get_settings().reference_ttl_account,
+    'account_number': get_settings().reference_ttl_account,
+    'account_name': get_settings().reference_ttl_account
+}
+DEFAULT_TTL = 15 * 60
+NEGATIVE_TTL = get_settings().reference_negative_ttl
+MAX_ENTRIES = get_settings().reference_cache_max_entries
+
+class InProcessRedis:
+    """Minimal stand-in for the subset of the Redis client API the cache uses"""
+
+    def __init__(self, clock=time.time):
+        self._values = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (value, self._clock() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._values.pop(key, None) is not None)
+
+class ReferenceCache:
+    """LRU-bounded TTL cache for Salesforce reference lookups, shared across warm invocations.
+
+    Entries live in process memory and, when a Redis-compatible client is given,
+    in that shared backend too so other instances can reuse them. "Not found"
+    results are cached for a shorter NEGATIVE_TTL; lookup errors are never cached.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttls=None, negative_ttl=NEGATIVE_TTL, shared=None, prefix='sot:ref:', clock=time.time):
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else ENTITY_TTLS
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self.prefix = prefix
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _local_set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _shared_get(self, key):
+        try:
+            raw = self.shared.get(self.prefix + json.dumps(key))
+        except Exception:
+            return None
+        if raw is None:
+            return None
+        payload = json.loads(raw)
+        return NOT_FOUND if payload.get('not_found') else payload.get('value')
+
+    def _shared_set(self, key, value, ttl):
+        payload = {'not_found': True} if value is NOT_FOUND else {'value': value}
+        try:
+            self.shared.set(self.prefix + json.dumps(key), json.dumps(payload), ex=ttl)
+        except Exception:
+            pass
+
+    def get_or_load(self, entity, key, load):
+        """Return the cached value for (entity, key), calling load() on a miss.
+
+        load() returns the value or NOT_FOUND, and raises on lookup errors.
+        """
+        cache_key = (entity, key)
+        entry = self._local_get(cache_key)
+        if entry is not None:
+            self._count(True)
+            return entry[0]
+
+        if self.shared is not None:
+            value = self._shared_get(cache_key)
+            if value is not None:
+                self._count(True)
+                self._local_set(cache_key, value, self.negative_ttl if value is NOT_FOUND else self.ttls.get(entity, DEFAULT_TTL))
+                return value
+
+        self._count(False)
+        value = load()
+        ttl = self.negative_ttl if value is NOT_FOUND else self.ttls.get(entity, DEFAULT_TTL)
+        self._local_set(cache_key, value, ttl)
+        if self.shared is not None:
+            self._shared_set(cache_key, value, ttl)
+        return value
+
+    def invalidate(self, entity, key):
+        with self._lock:
+            self._entries.pop((entity, key), None)
+        if self.shared is not None:
+            try:
+                self.shared.delete(self.prefix + json.dumps((entity, key)))
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+def _connect_shared_backend():
+    """Redis client for REDIS_URL, or None when unset or the redis package is not installed"""
+    redis_url = get_settings().redis_url
+    if not redis_url:
+        return None
+    try:
+        import redis
+    except ImportError:
+        return None
+    return redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_reference_cache():
+    """Get the container-wide reference cache, creating it on first use"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ReferenceCache(shared=_connect_shared_backend())
+        return _default_cache
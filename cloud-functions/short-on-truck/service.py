@@ -0,0 +1,82 @@
+"""Single entry point hosting every short-on-truck handler, routed by request path.
+
+All handlers run in one process, so they share the token cache, the pooled
+gateway sessions, the reference cache and the OpCo registry, and consecutive
+workflow steps for a case reach a warm instance. Deploy with --entry-point=service
+(and instance concurrency > 1), or run locally for load testing:
+
+    python service.py --port 8080
+"""
+import os
+import sys
+import argparse
+import threading
+import importlib.util
+import functions_framework
+from settings import get_settings
+
+FUNCTION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Request path -> (source file, handler); each route calls the handler its standalone function deploys
+ROUTES = {
+    '/get_case_details': ('get-case-details.py', 'get_case_details'),
+    '/childsr_handler': ('child-sr.py', 'childsr_handler'),
+    '/unrelated_handler': ('unrelated-handler.py', 'unrelated_handler'),
+    '/batch_process_cases': ('batch.py', 'batch_process_cases'),
+    '/send_to_validation': ('validation.py', 'send_to_validation'),
+    '/send_to_validation_batch': ('validation.py', 'send_to_validation_batch')
+}
+
+# Load every handler module at startup instead of on its first request
+PRELOAD = get_settings().service_preload
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+def load_handler_module(source):
+    """Import a handler file once per process; the hyphenated names cannot be imported normally"""
+    module = _modules.get(source)
+    if module is None:
+        with _modules_lock:
+            module = _modules.get(source)
+            if module is None:
+                name = 'sot_' + os.path.splitext(source)[0].replace('-', '_')
+                spec = importlib.util.spec_from_file_location(name, os.path.join(FUNCTION_DIR, source))
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[name] = module
+                spec.loader.exec_module(module)
+                _modules[source] = module
+    return module
+
+def get_handler(path):
+    """Handler for a request path, or None when no route matches"""
+    route = ROUTES.get('/' + path.strip('/'))
+    if route is None:
+        return None
+    source, handler = route
+    return getattr(load_handler_module(source), handler)
+
+if PRELOAD:
+    for source, _ in ROUTES.values():
+        load_handler_module(source)
+
+@functions_framework.http
+def service(request):
+    """HTTP Cloud Function dispatching to the short-on-truck handler for the request path"""
+    handler = get_handler(request.path)
+    if handler is None:
+        return {"error": f"No handler for {request.path}", "routes": sorted(ROUTES)}, 404
+    return handler(request)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the combined short-on-truck service locally')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=get_settings().port)
+    args = parser.parse_args()
+
+    app = functions_framework.create_app(target='service', source=os.path.abspath(__file__))
+    # Threaded, so concurrent requests share this process's warm caches as they would in production
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+# The .env file is read once per process here; modules import settings instead of calling load_dotenv themselves
+load_dotenv()
+
+@dataclass(frozen=True)
+class Settings:
+    """Deployment configuration shared by every handler, resolved once per process"""
+    gateway_url: str
+    client_id: str
+    client_secret: str
+    ces_gateway_url: str
+    ces_client_id: str
+    ces_client_secret: str
+    project_id: str
+    location: str
+    workflow_name: str
+
+    # Gateway sessions and token refresh
+    http_pool_size: int = 10
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 60.0
+    http_max_retries: int = 3
+    http_backoff_factor: float = 0.5
+    token_refresh_margin_seconds: int = 60
+
+    # Salesforce lookups; sf_composite_url overrides the composite endpoint behind the gateway
+    sf_resolver_mode: str = 'legacy'
+    sf_api_version: str = 'v59.0'
+    sf_composite_url: str = None
+
+    # Eligibility evaluation
+    ces_max_workers: int = 8
+    ces_streaming_parse: bool = True
+    ces_history_page_size: int = 10000
+    validation_max_workers: int = 4
+    validation_batch_max_workers: int = 4
+    validation_output_profile: str = 'lean'
+
+    # Batch discovery and workflow dispatch
+    batch_page_size: int = 200
+    batch_max_cases: int = 2000
+    batch_scan_mode: str = 'full'
+    workflow_max_workers: int = 8
+    workflow_rate_per_second: float = 10.0
+    workflow_max_retries: int = 3
+    dispatch_ledger_ttl_seconds: int = 6 * 60 * 60
+    dispatch_ledger_path: str = None
+    dispatch_ledger_bucket: str = None
+    state_bucket: str = None
+    state_file: str = None
+
+    # Case details
+    case_details_max_workers: int = 8
+    email_max_messages: int = 20
+    email_page_size: int = 200
+    email_compaction: bool = True
+    case_cache_enabled: bool = True
+    case_cache_max_entries: int = 500
+    case_cache_bucket: str = None
+    case_cache_file: str = None
+
+    # Reference data caches
+    opco_registry_refresh_seconds: int = 6 * 60 * 60
+    opco_registry_retry_seconds: int = 60
+    reference_ttl_opco: int = 24 * 60 * 60
+    reference_ttl_account: int = 60 * 60
+    reference_negative_ttl: int = 300
+    reference_cache_max_entries: int = 5000
+    redis_url: str = None
+
+    # Case handlers and the combined service
+    unrelated_owner_id: str = '00G8b000003nMZdEAM'
+    service_preload: bool = False
+    port: int = 8080
+
+    @property
+    def crm_url(self):
+        """Base URL of the Salesforce CRM APIs behind the gateway"""
+        return f"{self.gateway_url}/system/customer-relationship-management/v3"
+
+    @property
+    def composite_url(self):
+        return self.sf_composite_url or f"{self.crm_url}/composite"
+
+    @property
+    def workflow_parent(self):
+        return f"projects/{self.project_id}/locations/{self.location}/workflows/{self.workflow_name}"
+
+def _env(name, default, cast=str):
+    """Environment value converted with cast, or the Settings default when unset"""
+    value = os.getenv(name)
+    return default if value is None else cast(value)
+
+def load_settings():
+    """Resolve settings from the environment"""
+    gateway_url = os.getenv('GATEWAY_URL')
+    client_id = os.getenv('CLIENT_ID')
+    client_secret = os.getenv('CLIENT_SECRET')
+    return Settings(
+        gateway_url=gateway_url,
+        client_id=client_id,
+        client_secret=client_secret,
+        ces_gateway_url=os.getenv('CES_GATEWAY_URL', gateway_url),
+        ces_client_id=os.getenv('CES_CLIENT_ID', client_id),
+        ces_client_secret=os.getenv('CES_CLIENT_SECRET', client_secret),
+        project_id=os.getenv('PROJECT_ID'),
+        location=os.getenv('LOCATION'),
+        workflow_name=os.getenv('WORKFLOW_NAME'),
+        http_pool_size=_env('HTTP_POOL_SIZE', Settings.http_pool_size, int),
+        http_connect_timeout=_env('HTTP_CONNECT_TIMEOUT', Settings.http_connect_timeout, float),
+        http_read_timeout=_env('HTTP_READ_TIMEOUT', Settings.http_read_timeout, float),
+        http_max_retries=_env('HTTP_MAX_RETRIES', Settings.http_max_retries, int),
+        http_backoff_factor=_env('HTTP_BACKOFF_FACTOR', Settings.http_backoff_factor, float),
+        token_refresh_margin_seconds=_env('TOKEN_REFRESH_MARGIN_SECONDS', Settings.token_refresh_margin_seconds, int),
+        sf_resolver_mode=_env('SF_RESOLVER_MODE', Settings.sf_resolver_mode),
+        sf_api_version=_env('SF_API_VERSION', Settings.sf_api_version),
+        sf_composite_url=os.getenv('SF_COMPOSITE_URL'),
+        ces_max_workers=_env('CES_MAX_WORKERS', Settings.ces_max_workers, int),
+        ces_streaming_parse=os.getenv('CES_STREAMING_PARSE', '1') != '0',
+        ces_history_page_size=_env('CES_HISTORY_PAGE_SIZE', Settings.ces_history_page_size, int),
+        validation_max_workers=_env('VALIDATION_MAX_WORKERS', Settings.validation_max_workers, int),
+        validation_batch_max_workers=_env('VALIDATION_BATCH_MAX_WORKERS', Settings.validation_batch_max_workers, int),
+        validation_output_profile=_env('VALIDATION_OUTPUT_PROFILE', Settings.validation_output_profile),
+        batch_page_size=_env('BATCH_PAGE_SIZE', Settings.batch_page_size, int),
+        batch_max_cases=_env('BATCH_MAX_CASES', Settings.batch_max_cases, int),
+        # Incremental scans keep their watermark in the state store, so they are only the default with a durable one
+        batch_scan_mode=_env('BATCH_SCAN_MODE', 'incremental' if os.getenv('STATE_BUCKET') or os.getenv('STATE_FILE') else Settings.batch_scan_mode),
+        workflow_max_workers=_env('WORKFLOW_MAX_WORKERS', Settings.workflow_max_workers, int),
+        workflow_rate_per_second=_env('WORKFLOW_RATE_PER_SECOND', Settings.workflow_rate_per_second, float),
+        workflow_max_retries=_env('WORKFLOW_MAX_RETRIES', Settings.workflow_max_retries, int),
+        dispatch_ledger_ttl_seconds=_env('DISPATCH_LEDGER_TTL_SECONDS', Settings.dispatch_ledger_ttl_seconds, int),
+        dispatch_ledger_path=os.getenv('DISPATCH_LEDGER_PATH'),
+        dispatch_ledger_bucket=os.getenv('DISPATCH_LEDGER_BUCKET', os.getenv('STATE_BUCKET')),
+        state_bucket=os.getenv('STATE_BUCKET'),
+        state_file=os.getenv('STATE_FILE'),
+        case_details_max_workers=_env('CASE_DETAILS_MAX_WORKERS', Settings.case_details_max_workers, int),
+        email_max_messages=_env('EMAIL_MAX_MESSAGES', Settings.email_max_messages, int),
+        email_page_size=_env('EMAIL_PAGE_SIZE', Settings.email_page_size, int),
+        email_compaction=os.getenv('EMAIL_COMPACTION', '1') != '0',
+        case_cache_enabled=os.getenv('CASE_CACHE', '1') != '0',
+        case_cache_max_entries=_env('CASE_CACHE_MAX_ENTRIES', Settings.case_cache_max_entries, int),
+        case_cache_bucket=os.getenv('CASE_CACHE_BUCKET'),
+        case_cache_file=os.getenv('CASE_CACHE_FILE'),
+        opco_registry_refresh_seconds=_env('OPCO_REGISTRY_REFRESH_SECONDS', Settings.opco_registry_refresh_seconds, int),
+        opco_registry_retry_seconds=_env('OPCO_REGISTRY_RETRY_SECONDS', Settings.opco_registry_retry_seconds, int),
+        reference_ttl_opco=_env('REFERENCE_TTL_OPCO', Settings.reference_ttl_opco, int),
+        reference_ttl_account=_env('REFERENCE_TTL_ACCOUNT', Settings.reference_ttl_account, int),
+        reference_negative_ttl=_env('REFERENCE_NEGATIVE_TTL', Settings.reference_negative_ttl, int),
+        reference_cache_max_entries=_env('REFERENCE_CACHE_MAX_ENTRIES', Settings.reference_cache_max_entries, int),
+        redis_url=os.getenv('REDIS_URL'),
+        unrelated_owner_id=_env('UNRELATED_OWNER_ID', Settings.unrelated_owner_id),
+        service_preload=os.getenv('SERVICE_PRELOAD', '0') == '1',
+        port=_env('PORT', Settings.port, int)
+    )
+
+_settings = None
+
+def get_settings():
+    """Get the process-wide settings, resolving them on first use"""
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
@@ -0,0 +1,44 @@
+from urllib.parse import urljoin
+from token_cache import authorized_request
+from settings import get_settings
+
+def iter_query_records(url, params=None, headers=None, page_size=None, max_records=None):
+    """Yield records from a Salesforce query, following nextRecordsUrl pages lazily.
+
+    The next page is only requested once the caller has consumed the current one,
+    so work on early records can start while later pages are still loading.
+    """
+    headers = dict(headers or {})
+    if page_size:
+        headers['Sforce-Query-Options'] = f'batchSize={int(page_size)}'
+
+    yielded = 0
+    next_url, next_params = url, params
+    while next_url:
+        response = authorized_request('GET', next_url, headers=headers, params=next_params)
+        if response.status_code != 200:
+            raise Exception(f"Query failed: {response.text}")
+
+        data = response.json()
+        for record in data.get('records', []):
+            if max_records is not None and yielded >= max_records:
+                return
+            yield record
+            yielded += 1
+        if max_records is not None and yielded >= max_records:
+            return
+
+        next_records_url = data.get('nextRecordsUrl')
+        if data.get('done', True) or not next_records_url:
+            return
+        # Follow-up pages are addressed by nextRecordsUrl alone, relative to the gateway
+        next_url, next_params = urljoin(url, next_records_url), None
+
+def query_records(sobject, fields, filters, headers=None):
+    """Run a single-page Salesforce query, raising on gateway errors so they are never cached as not-found"""
+    url = f"{get_settings().crm_url}/sobjects/{sobject}/query"
+    params = {'fields': fields, 'filters': filters}
+    response = authorized_request('GET', url, headers=headers, params=params)
+    if response.status_code != 200:
+        raise Exception(f"{sobject} query failed: {response.text}")
+    return response.json()
@@ -0,0 +1,100 @@
+from urllib.parse import quote
+from token_cache import authorized_request
+from fetch_cache import FetchCache
+from sf_query import query_records
+from settings import get_settings
+
+
+# 'legacy' issues one query per lookup; 'merged' combines lookups that hit the same
+# object; 'composite' additionally prefetches them in a single composite request
+RESOLVER_MODE = get_settings().sf_resolver_mode
+SF_API_VERSION = get_settings().sf_api_version
+
+INVOICE_LINE_FIELDS = 'SUPC__c, Invoice__r.Account__c'
+ACCOUNT_FIELDS = 'Account_ID__c, Name, OpCo__c'
+
+def _soql_query(fields, sobject, filters):
+    return f"/services/data/{SF_API_VERSION}/query?q={quote(f'SELECT {fields} FROM {sobject} WHERE {filters}')}"
+
+def _invoice_lines_filter(invoice_num):
+    # Same expression as the legacy get_supcs_from_invoice query, so every path returns the same rows
+    return f"Invoice__c.Invoice_Number__c='{invoice_num}'"
+
+def _invoice_line_account(record):
+    # Relationship fields come back nested ({'Invoice__r': {'Account__c': ...}}) or flattened
+    invoice = record.get('Invoice__r') or {}
+    return invoice.get('Account__c') or record.get('Invoice__r.Account__c')
+
+class SalesforceResolver:
+    """Request-scoped Salesforce lookups for validate_agent_response using as few gateway calls as possible.
+
+    Invoice -> Account and invoice SUPCs come from one Invoice_Line_Item__c query,
+    Account validity and Name from one Account query. In composite mode both
+    are fetched up front in a single composite request; if that fails the
+    merged queries are used instead. query and composite can be swapped for
+    fakes in tests.
+    """
+
+    def __init__(self, headers=None, mode=None, query=None, composite=None):
+        self.headers = headers
+        self.mode = mode or RESOLVER_MODE
+        self._query = query or (lambda sobject, fields, filters: query_records(sobject, fields, filters, self.headers))
+        self._composite = composite or self._gateway_composite
+        self._cache = FetchCache()
+
+    def _gateway_composite(self, subrequests):
+        url = get_settings().composite_url
+        body = {'allOrNone': False, 'compositeRequest': subrequests}
+        response = authorized_request('POST', url, headers=self.headers, json=body)
+        if response.status_code != 200:
+            raise Exception(f"Composite request failed: {response.text}")
+        return response.json().get('compositeResponse', [])
+
+    def prefetch(self, invoice_num=None, account_id=None):
+        """Fetch every lookup already known to be needed in one composite request (composite mode only)"""
+        if self.mode != 'composite':
+            return
+        
+        planned = {}
+        if invoice_num and invoice_num != "I'm not sure":
+            planned['invoice_lines'] = (('invoice_lines', invoice_num), _soql_query(INVOICE_LINE_FIELDS, 'Invoice_Line_Item__c', _invoice_lines_filter(invoice_num)))
+        if account_id and account_id != "I'm not sure":
+            planned['account'] = (('account', account_id), _soql_query(ACCOUNT_FIELDS, 'Account', f"Account_ID__c = '{account_id}'"))
+        if not planned:
+            return
+        
+        subrequests = [{'method': 'GET', 'url': url, 'referenceId': ref} for ref, (_, url) in planned.items()]
+        try:
+            responses = self._composite(subrequests)
+        except Exception:
+            return
+        for response in responses:
+            ref = response.get('referenceId')
+            if ref in planned and response.get('httpStatusCode') == 200:
+                self._cache.prime(planned[ref][0], response.get('body') or {})
+
+    def invoice_lines(self, invoice_num):
+        """SUPCs on the invoice together with the invoice's account"""
+        return self._cache.get_or_fetch(('invoice_lines', invoice_num), lambda: self._query(
+            'Invoice_Line_Item__c', INVOICE_LINE_FIELDS, _invoice_lines_filter(invoice_num)))
+
+    def invoice_account(self, invoice_num):
+        """Account for an invoice, read off its line items when it has any"""
+        for record in self.invoice_lines(invoice_num).get('records', []):
+            account_id = _invoice_line_account(record)
+            if account_id:
+                return account_id
+        
+        data = self._cache.get_or_fetch(('invoice', invoice_num), lambda: self._query(
+            'Invoice__c', 'Account__c', f"Invoice_Number__c='{invoice_num}'"))
+        if data.get('totalSize', 0) > 0:
+            return data['records'][0]['Account__c']
+        return None
+
+    def account(self, account_id):
+        """Account_ID__c, Name and OpCo__c for an account in one query"""
+        return self._cache.get_or_fetch(('account', account_id), lambda: self._query(
+            'Account', ACCOUNT_FIELDS, f"Account_ID__c='{account_id}'"))
+
+    def stats(self):
+        return self._cache.stats()
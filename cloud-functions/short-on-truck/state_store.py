@@ -0,0 +1,82 @@
+import os
+import json
+import tempfile
+import threading
+from settings import get_settings
+
+class InMemoryStateStore:
+    """Process-local key/value state; only survives while the instance stays warm"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+class LocalFileStateStore:
+    """Key/value state kept in a JSON file, for local runs and tests"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._read().get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            values = self._read()
+            values[key] = value
+            # Write to a temp file and rename so a crash never leaves a half-written state file
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(values, f)
+            os.replace(tmp_path, self.path)
+
+class GcsStateStore:
+    """Key/value state kept as one JSON object per key in a Cloud Storage bucket"""
+
+    def __init__(self, bucket_name, prefix='short-on-truck-state/'):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        blob = self.bucket.blob(f"{self.prefix}{key}.json")
+        if not blob.exists():
+            return default
+        return json.loads(blob.download_as_text())
+
+    def set(self, key, value):
+        self.bucket.blob(f"{self.prefix}{key}.json").upload_from_string(json.dumps(value), content_type='application/json')
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_state_store():
+    """Get the configured state store: STATE_BUCKET (GCS), STATE_FILE (local JSON) or in-memory"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            if get_settings().state_bucket:
+                _default_store = GcsStateStore(get_settings().state_bucket)
+            elif get_settings().state_file:
+                _default_store = LocalFileStateStore(get_settings().state_file)
+            else:
+                _default_store = InMemoryStateStore()
+        return _default_store
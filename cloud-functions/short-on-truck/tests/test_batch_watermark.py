@@ -0,0 +1,170 @@
+import os
+import re
+import importlib.util
+import pytest
+import http_client
+import token_cache
+import settings
+from state_store import LocalFileStateStore, InMemoryStateStore
+from dispatch_ledger import InMemoryDispatchLedger
+from workflow_dispatch import WorkflowDispatcher
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Cases in the order the gateway stores them; CreatedDate order is C0 < C1 < ... < C5
+CASES = [
+    {'Id': 'C0', 'CreatedDate': '2030-01-01T00:00:00.000+0000'},
+    {'Id': 'C3', 'CreatedDate': '2030-01-04T00:00:00.000+0000'},
+    {'Id': 'C1', 'CreatedDate': '2030-01-02T00:00:00.000+0000'},
+    {'Id': 'C5', 'CreatedDate': '2030-01-05T00:00:00.000+0000'},
+    {'Id': 'C2', 'CreatedDate': '2030-01-03T00:00:00.000+0000'},
+    {'Id': 'C4', 'CreatedDate': '2030-01-05T00:00:00.000+0000'}
+]
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+class FakeExecutionsClient:
+    def __init__(self):
+        self.case_ids = []
+
+    def create_execution(self, parent, execution):
+        self.case_ids.append(execution)
+        return type('Execution', (), {'name': f'executions/{execution}'})
+
+class FakeRequest:
+    def __init__(self, data):
+        self.data = data
+
+    def get_json(self, silent=True):
+        return self.data
+
+class FakeCaseQuery:
+    """Case query served one record per page.
+
+    When honour_query is set, the watermark keyset condition and ORDER BY
+    CreatedDate, Id are applied; otherwise rows come back in storage order.
+    """
+
+    def __init__(self, honour_query=True):
+        self.honour_query = honour_query
+        self.cursors = []
+
+    def request(self, method, url, headers=None, params=None, **kwargs):
+        if '/query/next-' in url:
+            cursor, page = (int(part) for part in url.rsplit('next-', 1)[1].split('-'))
+        else:
+            cursor, page = len(self.cursors), 0
+            self.cursors.append(self.run_query(params['filters']))
+        rows = self.cursors[cursor]
+        data = {'records': rows[page:page + 1], 'done': page + 1 >= len(rows)}
+        if not data['done']:
+            data['nextRecordsUrl'] = f'/query/next-{cursor}-{page + 1}'
+        return FakeResponse(200, data)
+
+    def run_query(self, filters):
+        rows = list(CASES)
+        if not self.honour_query:
+            return rows
+        keyset = re.search(r"CreatedDate > (\S+) OR \(CreatedDate = \S+ AND Id > '(\w+)'\)", filters)
+        if keyset:
+            after = (keyset.group(1)[:19], keyset.group(2))
+            rows = [row for row in rows if (row['CreatedDate'][:19], row['Id']) > after]
+        if filters.endswith('ORDER BY CreatedDate, Id'):
+            rows.sort(key=lambda row: (row['CreatedDate'], row['Id']))
+        return rows
+
+@pytest.fixture
+def batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(token_cache, 'get_token', lambda profile='salesforce': {'access_token': 'token'})
+    gateway = FakeCaseQuery()
+    monkeypatch.setattr(http_client, 'request', gateway.request)
+
+    spec = importlib.util.spec_from_file_location('batch_under_test', os.path.join(FUNCTION_DIR, 'batch.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    state_store = LocalFileStateStore(str(tmp_path / 'state.json'))
+    monkeypatch.setattr(module, 'get_state_store', lambda: state_store)
+    client = FakeExecutionsClient()
+    module._dispatcher = WorkflowDispatcher(
+        client, 'parent', build_execution=lambda case_id: case_id, rate_per_second=1000, ledger=InMemoryDispatchLedger()
+    )
+    module.gateway = gateway
+    return module, state_store, client
+
+def test_repeated_capped_runs_make_progress(batch):
+    module, state_store, client = batch
+    state_store.set(module.WATERMARK_KEY, {'created_date': '2030-01-01T00:00:00.000Z', 'id': 'C0'})
+
+    for _ in range(5):
+        module.batch_process_cases(FakeRequest({'max_cases': 2, 'mode': 'incremental'}))
+
+    assert client.case_ids == ['C1', 'C2', 'C3', 'C4', 'C5']
+    assert state_store.get(module.WATERMARK_KEY) == {'created_date': '2030-01-05T00:00:00.000Z', 'id': 'C5'}
+
+def test_cases_sharing_the_watermark_second_are_not_skipped(batch):
+    module, state_store, client = batch
+    state_store.set(module.WATERMARK_KEY, {'created_date': '2030-01-05T00:00:00.000Z', 'id': 'C4'})
+
+    response = module.batch_process_cases(FakeRequest({'max_cases': 1, 'mode': 'incremental'}))
+
+    assert client.case_ids == ['C5']
+    assert response['watermark'] == {'created_date': '2030-01-05T00:00:00.000Z', 'id': 'C5'}
+
+def test_unordered_capped_scan_does_not_advance_watermark(batch):
+    module, state_store, client = batch
+    module.gateway.honour_query = False
+    watermark = {'created_date': '2030-01-01T00:00:00.000Z', 'id': 'C0'}
+    state_store.set(module.WATERMARK_KEY, watermark)
+
+    response = module.batch_process_cases(FakeRequest({'max_cases': 3, 'mode': 'incremental'}))
+
+    # Without the ordering, C2 may still be ahead of the cap, so the watermark has to stay put
+    assert client.case_ids == ['C3', 'C1']
+    assert response['watermark'] == watermark
+    assert state_store.get(module.WATERMARK_KEY) == watermark
+
+    module.batch_process_cases(FakeRequest({'max_cases': 10, 'mode': 'incremental'}))
+
+    assert sorted(client.case_ids) == ['C1', 'C2', 'C3', 'C4', 'C5']
+    assert state_store.get(module.WATERMARK_KEY) == {'created_date': '2030-01-05T00:00:00.000Z', 'id': 'C5'}
+
+def test_complete_scan_advances_watermark(batch):
+    module, state_store, client = batch
+
+    response = module.batch_process_cases(FakeRequest({'max_cases': 10, 'mode': 'full'}))
+
+    assert client.case_ids == ['C0', 'C1', 'C2', 'C3', 'C4', 'C5']
+    assert response['watermark'] == {'created_date': '2030-01-05T00:00:00.000Z', 'id': 'C5'}
+    assert state_store.get(module.WATERMARK_KEY) == response['watermark']
+
+def test_incremental_scan_needs_a_durable_state_store(batch, monkeypatch):
+    module, _, client = batch
+    monkeypatch.setattr(module, 'get_state_store', lambda: InMemoryStateStore())
+
+    response, status = module.batch_process_cases(FakeRequest({'mode': 'incremental'}))
+
+    assert status == 500
+    assert 'STATE_BUCKET or STATE_FILE' in response['error']
+    assert client.case_ids == []
+
+@pytest.mark.parametrize('env, scan_mode', [
+    ({}, 'full'),
+    ({'STATE_FILE': 'state.json'}, 'incremental'),
+    ({'STATE_BUCKET': 'bucket'}, 'incremental'),
+    ({'STATE_FILE': 'state.json', 'BATCH_SCAN_MODE': 'full'}, 'full')
+])
+def test_default_scan_mode_follows_state_store(monkeypatch, env, scan_mode):
+    for name in ('STATE_FILE', 'STATE_BUCKET', 'BATCH_SCAN_MODE'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    assert settings.load_settings().batch_scan_mode == scan_mode
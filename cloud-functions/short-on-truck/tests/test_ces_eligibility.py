@@ -0,0 +1,197 @@
+import io
+import json
+import time
+import threading
+import pytest
+import http_client
+import token_cache
+import validation
+
+# opco ABC: (invoice, SUPC) -> ordered, delivered, rejected, scheduled delivery date
+DELIVERIES = {
+    ('INV1', 'S1'): (10, 10, 0, '2030-01-05'),
+    ('INV1', 'S2'): (10, 7, 1, '2030-01-05'),
+    ('INV1', 'S3'): (5, 2, 0, '2030-01-05'),
+    ('INV1', 'S4'): (4, 0, 0, '2030-01-10'),
+    ('INV2', 'S1'): (8, 6, 0, '2030-01-03'),
+    ('INV2', 'S5'): (3, 0, 0, '2029-12-01')
+}
+
+# Prior credits on the customer's account; the 2030-01-04 INV1/S2 credit predates INV1's delivery, so it never counts
+CREDIT_HISTORY = [
+    {'invoiceRefNumber': 'INV1', 'itemNumber': 'S2', 'transCode': 'C', 'originalShipQty': -3, 'invoiceDate': '2030-01-04'},
+    {'invoiceRefNumber': 'INV1', 'itemNumber': 'S2', 'transCode': 'C', 'originalShipQty': -1, 'invoiceDate': '2030-01-06'},
+    {'invoiceRefNumber': 'INV1', 'itemNumber': 'S3', 'transCode': 'C', 'originalShipQty': -5, 'invoiceDate': '2030-01-07'},
+    {'invoiceRefNumber': 'INV1', 'itemNumber': 'S3', 'transCode': 'I', 'originalShipQty': 5, 'invoiceDate': '2030-01-07'},
+    {'invoiceRefNumber': 'INV2', 'itemNumber': 'S1', 'transCode': 'C', 'originalShipQty': -2, 'invoiceDate': '2030-01-04'}
+]
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+    @property
+    def raw(self):
+        return io.BytesIO(self.text.encode('utf-8'))
+
+    def close(self):
+        pass
+
+class FakeCesGateway:
+    """CES invoice, delivery and customer history endpoints over DELIVERIES, counting requests per path.
+
+    Customer history is filtered by date_from and paged by page_size and page_number.
+    With dated unset the history items come back without invoiceDate, and with
+    paging unset every page number is served the first page.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = {}
+        self.history_params = []
+        self.dated = True
+        self.paging = True
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, **kwargs):
+        path = url.split('/services/enterprise-invoice-service-v2/invoice/', 1)[1]
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        time.sleep(self.delay)
+
+        parts = path.split('/')
+        if 'customers' in parts:
+            with self._lock:
+                self.history_params.append(dict(params))
+            items = [item for item in CREDIT_HISTORY if item['invoiceDate'] >= params['date_from']]
+            if not self.dated:
+                items = [{key: value for key, value in item.items() if key != 'invoiceDate'} for item in items]
+            page_number = params.get('page_number', 1) if self.paging else 1
+            page_size = params['page_size']
+            return FakeResponse(200, {'totalItems': len(items), 'items': items[(page_number - 1) * page_size:page_number * page_size]})
+        invoice = parts[-2] if parts[-1] == 'delivery' else parts[-1]
+        lines = [(supc, values) for (number, supc), values in DELIVERIES.items() if number == invoice]
+        if not lines:
+            return FakeResponse(404, {})
+        if parts[-1] == 'delivery':
+            items = [
+                {'itemNumber': supc, 'quantity': ordered, 'deliveredItemQty': delivered, 'rejectedItemQty': rejected, 'scheduledDeliveryDate': delivery_date}
+                for supc, (ordered, delivered, rejected, delivery_date) in lines
+            ]
+        else:
+            items = [{'itemNumber': supc, 'quantity': ordered, 'splitCode': 'S'} for supc, (ordered, _, _, _) in lines]
+        return FakeResponse(200, {'totalItems': len(items), 'items': items})
+
+@pytest.fixture
+def gateway(monkeypatch):
+    fake = FakeCesGateway(delay=0.01)
+    monkeypatch.setattr(token_cache, 'get_token', lambda profile='salesforce': {'access_token': 'token'})
+    monkeypatch.setattr(http_client, 'request', fake.request)
+    return fake
+
+def sf_details():
+    requests = [
+        {'InvoiceNumber': 'INV1', 'SUPC': 'S1', 'MissingQuantity': '1'},
+        {'InvoiceNumber': 'INV1', 'SUPC': 'S2', 'MissingQuantity': '2'},
+        {'InvoiceNumber': 'INV2', 'SUPC': 'S1', 'MissingQuantity': '2'},
+        {'InvoiceNumber': 'INV1', 'SUPC': 'S3', 'MissingQuantity': '3'},
+        {'InvoiceNumber': 'INV1', 'SUPC': 'S2', 'MissingQuantity': '5'},
+        {'InvoiceNumber': 'INV1', 'SUPC': 'S4', 'MissingQuantity': '4'},
+        {'InvoiceNumber': 'INV2', 'SUPC': 'S5', 'MissingQuantity': '1'},
+        {'InvoiceNumber': 'INV1', 'SUPC': 'NOPE', 'MissingQuantity': '1'},
+        {'InvoiceNumber': 'INV9', 'SUPC': 'S1', 'MissingQuantity': '1'}
+    ]
+    return {'account_id': 'ABC-12345', 'opco_code': 'ABC', 'CaseCreationDate': '2030-01-10T10:00:00.000+0000', 'credit_requests': requests}
+
+def statuses_of(groups):
+    return {(group['invoice'], item['SUPC']): item['Status'] for group in groups for item in group['credits_eligibility']}
+
+def test_concurrent_evaluation_matches_serial(gateway):
+    serial = validation.ces_process_credit_eligibility(sf_details(), max_workers=1)
+    concurrent = validation.ces_process_credit_eligibility(sf_details(), max_workers=8)
+
+    assert concurrent == serial
+    assert [group['invoice'] for group in concurrent] == ['INV1', 'INV2', 'INV9']
+    assert [item['SUPC'] for item in concurrent[0]['credits_eligibility']] == ['S1', 'S2', 'S3', 'S2', 'S4', 'NOPE']
+
+def test_each_resource_is_fetched_once(gateway):
+    validation.ces_process_credit_eligibility(sf_details(), max_workers=8)
+
+    assert set(gateway.requests.values()) == {1}
+    assert set(gateway.requests) == {
+        'details/opcos/ABC/invoices/INV1',
+        'details/opcos/ABC/invoices/INV1/delivery',
+        'details/opcos/ABC/invoices/INV2',
+        'details/opcos/ABC/invoices/INV2/delivery',
+        'details/opcos/ABC/invoices/INV9',
+        'extended/details/opcos/ABC/customers/12345'
+    }
+    # Widest window of the lines that need history; the on-hold 2029-12-01 line does not widen it
+    assert [params['date_from'] for params in gateway.history_params] == ['2030-01-03']
+
+def test_duplicate_lines_share_one_result(gateway):
+    groups = validation.ces_process_credit_eligibility(sf_details(), max_workers=8)
+    duplicates = [item for item in groups[0]['credits_eligibility'] if item['SUPC'] == 'S2']
+
+    assert [item['sot_credits_requested'] for item in duplicates] == [2, 2]
+    assert duplicates[0] == duplicates[1]
+
+def test_eligibility_statuses(gateway):
+    statuses = statuses_of(validation.ces_process_credit_eligibility(sf_details(), max_workers=8))
+
+    assert statuses[('INV1', 'S1')].startswith('Not eligible - the order is fully loaded')
+    assert statuses[('INV1', 'S2')] == 'Eligible for credit'
+    assert statuses[('INV1', 'S3')] == 'Lesser credits eligible as partial credits are already processed'
+    assert statuses[('INV1', 'S4')] == 'On Hold - Case created within 24 hours of delivery'
+    assert statuses[('INV2', 'S1')] == 'Credits not eligible as exact quantities match with previous processed credit'
+    assert statuses[('INV2', 'S5')] == 'On Hold - Case created after 14 days of delivery'
+    assert statuses[('INV1', 'NOPE')] == 'Item not found in main invoice'
+    assert statuses[('INV9', 'S1')] == 'invoice data not found'
+
+def test_history_is_read_past_the_page_size(gateway, monkeypatch):
+    expected = validation.ces_process_credit_eligibility(sf_details(), max_workers=1)
+    gateway.history_params.clear()
+    monkeypatch.setattr(validation, 'CES_HISTORY_PAGE_SIZE', 2)
+
+    assert validation.ces_process_credit_eligibility(sf_details(), max_workers=8) == expected
+    assert [params.get('page_number') for params in gateway.history_params] == [None, 2, 3]
+
+def test_incomplete_history_fails_the_lines_that_need_it(gateway, monkeypatch):
+    gateway.paging = False
+    monkeypatch.setattr(validation, 'CES_HISTORY_PAGE_SIZE', 2)
+
+    with pytest.raises(Exception, match='Customer history for 12345 is incomplete: read 2 of 5 items'):
+        validation.ces_process_credit_eligibility(sf_details(), max_workers=8)
+
+    # Lines decided without the history are unaffected
+    outcome = validation.ces_process_credit_eligibility(sf_details(), max_workers=8, per_entry=True)[0]
+    assert isinstance(outcome, Exception)
+    held = dict(sf_details(), credit_requests=[{'InvoiceNumber': 'INV1', 'SUPC': 'S4', 'MissingQuantity': '4'}])
+    assert statuses_of(validation.ces_process_credit_eligibility(held, max_workers=8)) == {
+        ('INV1', 'S4'): 'On Hold - Case created within 24 hours of delivery'
+    }
+
+def test_undated_history_falls_back_to_each_line_window(gateway):
+    expected = validation.ces_process_credit_eligibility(sf_details(), max_workers=1)
+    gateway.dated = False
+    gateway.history_params.clear()
+
+    assert validation.ces_process_credit_eligibility(sf_details(), max_workers=8, fetch_cache=validation.FetchCache()) == expected
+    assert sorted(params['date_from'] for params in gateway.history_params) == ['2030-01-03', '2030-01-05']
+
+def test_per_entry_outcomes_match_entries_run_alone(gateway):
+    first = sf_details()
+    second = dict(sf_details(), credit_requests=[{'InvoiceNumber': 'INV2', 'SUPC': 'S1', 'MissingQuantity': '7'}])
+    broken = {'opco_code': 'ABC', 'account_id': 'no-dash-here-', 'credit_requests': []}
+
+    outcomes = validation.ces_process_credit_eligibility([first, broken, second], max_workers=8, per_entry=True)
+
+    assert outcomes[0] == validation.ces_process_credit_eligibility(first, max_workers=1)
+    assert isinstance(outcomes[1], Exception)
+    assert outcomes[2] == validation.ces_process_credit_eligibility(second, max_workers=1)
+    assert outcomes[2][0]['credits_eligibility'][0]['sot_credits_requested'] == 7
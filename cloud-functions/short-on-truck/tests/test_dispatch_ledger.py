@@ -0,0 +1,134 @@
+import threading
+import pytest
+from google.api_core.exceptions import PreconditionFailed, NotFound
+from dispatch_ledger import InMemoryDispatchLedger, SqliteDispatchLedger, GcsDispatchLedger
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeBlob:
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.generation = generation
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        with self.bucket.lock:
+            current = self.bucket.objects.get(self.name)
+            if if_generation_match is not None and (current[0] if current else 0) != if_generation_match:
+                raise PreconditionFailed(self.name)
+            self.bucket.generation += 1
+            self.bucket.objects[self.name] = (self.bucket.generation, data)
+
+    def download_as_text(self, if_generation_match=None):
+        with self.bucket.lock:
+            current = self.bucket.objects.get(self.name)
+            if current is None:
+                raise NotFound(self.name)
+            if if_generation_match is not None and current[0] != if_generation_match:
+                raise PreconditionFailed(self.name)
+            return current[1]
+
+    def delete(self):
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise NotFound(self.name)
+
+class FakeBucket:
+    """Cloud Storage bucket with object generations and generation preconditions"""
+
+    def __init__(self):
+        self.objects = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        with self.lock:
+            current = self.objects.get(name)
+        return FakeBlob(self, name, current[0]) if current else None
+
+@pytest.fixture(params=['memory', 'sqlite', 'gcs'])
+def make_ledger(request, tmp_path):
+    """Factory for ledgers of one backend that share their storage, with a shared fake clock"""
+    clock = FakeClock()
+    bucket = FakeBucket()
+    shared = InMemoryDispatchLedger(ttl_seconds=60, clock=clock)
+
+    def make():
+        if request.param == 'memory':
+            return shared
+        if request.param == 'sqlite':
+            return SqliteDispatchLedger(str(tmp_path / 'ledger.db'), ttl_seconds=60, clock=clock)
+        return GcsDispatchLedger('bucket', ttl_seconds=60, clock=clock, bucket=bucket)
+    make.clock = clock
+    return make
+
+def test_claim_is_exclusive(make_ledger):
+    first, second = make_ledger(), make_ledger()
+
+    assert first.claim('C1')
+    assert not first.claim('C1')
+    assert not second.claim('C1')
+    assert second.claim('C2')
+
+def test_release_allows_a_new_claim(make_ledger):
+    first, second = make_ledger(), make_ledger()
+
+    assert first.claim('C1')
+    first.release('C1')
+    assert second.claim('C1')
+    second.release('C1')
+    second.release('C1')
+
+def test_claim_expires_after_ttl(make_ledger):
+    first, second = make_ledger(), make_ledger()
+
+    assert first.claim('C1')
+    make_ledger.clock.now += 59
+    assert not second.claim('C1')
+    make_ledger.clock.now += 1
+    assert second.claim('C1')
+    assert not first.claim('C1')
+
+def test_concurrent_claims_have_one_winner(make_ledger):
+    ledgers = [make_ledger() for _ in range(8)]
+    barrier = threading.Barrier(len(ledgers))
+    results = []
+
+    def claim(ledger):
+        barrier.wait()
+        results.append(ledger.claim('C1'))
+
+    threads = [threading.Thread(target=claim, args=(ledger,)) for ledger in ledgers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
+
+def test_expired_claim_is_taken_over_once(make_ledger):
+    assert make_ledger().claim('C1')
+    make_ledger.clock.now += 120
+    ledgers = [make_ledger() for _ in range(8)]
+    barrier = threading.Barrier(len(ledgers))
+    results = []
+
+    def claim(ledger):
+        barrier.wait()
+        results.append(ledger.claim('C1'))
+
+    threads = [threading.Thread(target=claim, args=(ledger,)) for ledger in ledgers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
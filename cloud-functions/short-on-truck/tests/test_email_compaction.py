@@ -0,0 +1,35 @@
+from email_compaction import compact_text, compact_emails
+
+def test_sign_off_followed_by_request_is_kept():
+    text = "Hi,\nThe order was short 2 cases.\nThanks!\nAlso the lettuce was missing, please credit that too."
+    assert compact_text(text) == text
+
+def test_sign_off_with_name_block_is_dropped():
+    text = "Please credit the short cases.\nThanks,\nJane Doe\nPurchasing Manager"
+    assert compact_text(text) == "Please credit the short cases."
+
+def test_mobile_footer_followed_by_request_is_kept():
+    text = "Short on lettuce.\nSent from my iPhone\nAlso the tomatoes were missing."
+    assert compact_text(text) == text
+
+def test_forwarded_message_is_kept():
+    text = (
+        "See below.\nThanks\nBob\n"
+        "---------- Forwarded message ---------\n"
+        "From: Chef\nWe are missing 3 cases of lettuce.\nThanks\nChef"
+    )
+    assert compact_text(text) == (
+        "See below.\n"
+        "---------- Forwarded message ---------\n"
+        "From: Chef\nWe are missing 3 cases of lettuce.\nThanks\nChef"
+    )
+
+def test_quoted_reply_is_dropped():
+    text = "Got it, thanks.\n\nOn Mon, Jan 1, 2024 at 9:00 AM Bob <bob@example.com> wrote:\n> Is anything missing?"
+    assert compact_text(text) == "Got it, thanks."
+
+def test_repeated_bodies_are_dropped():
+    emails = [{'text_body': 'Missing lettuce.'}, {'text_body': 'Missing lettuce.\n-- \nBob'}]
+    kept, stats = compact_emails(emails)
+    assert kept == [{'text_body': 'Missing lettuce.'}]
+    assert stats['duplicates_dropped'] == 1
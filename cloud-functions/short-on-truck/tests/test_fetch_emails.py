@@ -0,0 +1,63 @@
+import os
+import re
+import importlib.util
+import pytest
+import http_client
+import token_cache
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+def email_gateway(count, queries):
+    """EmailMessage query over count emails, honouring Id IN filters and the Id/CreatedDate projection"""
+    emails = [
+        {'Id': f'E{i:02d}', 'TextBody': f'body {i}', 'CreatedDate': f'2030-01-{i + 1:02d}T00:00:00.000+0000'}
+        for i in range(count)
+    ]
+
+    def request(method, url, headers=None, params=None, **kwargs):
+        queries.append((params['fields'], headers.get('Sforce-Query-Options')))
+        ids = re.findall(r"'(E\d+)'", params['filters'])
+        records = [email for email in emails if not ids or email['Id'] in ids]
+        if params['fields'] == 'Id, CreatedDate':
+            records = [{'Id': email['Id'], 'CreatedDate': email['CreatedDate']} for email in records]
+        return FakeResponse(200, {'totalSize': len(records), 'records': records, 'done': True})
+    return request
+
+@pytest.fixture
+def case_details(monkeypatch):
+    monkeypatch.setattr(token_cache, 'get_token', lambda profile='salesforce': {'access_token': 'token'})
+    spec = importlib.util.spec_from_file_location('case_details_under_test', os.path.join(FUNCTION_DIR, 'get-case-details.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_case_within_limit_costs_one_query(case_details, monkeypatch):
+    queries = []
+    monkeypatch.setattr(http_client, 'request', email_gateway(3, queries))
+
+    emails = case_details.fetch_emails('C1', {}, max_messages=20)
+
+    assert queries == [('Id, Subject, FromAddress, FromName, ToAddress, TextBody, CreatedDate', 'batchSize=21')]
+    assert emails['totalSize'] == 3
+    assert [email['Id'] for email in emails['index']] == ['E00', 'E01', 'E02']
+
+def test_case_over_limit_fetches_newest_bodies(case_details, monkeypatch):
+    queries = []
+    monkeypatch.setattr(http_client, 'request', email_gateway(5, queries))
+
+    emails = case_details.fetch_emails('C1', {}, max_messages=2)
+
+    assert emails['totalSize'] == 5
+    assert len(emails['index']) == 5
+    assert sorted(email['Id'] for email in emails['records']) == ['E03', 'E04']
+    # Only the probe is sized by the limit; the index is read at the full page size
+    assert [batch_size for _, batch_size in queries] == ['batchSize=3', f'batchSize={case_details.EMAIL_PAGE_SIZE}', f'batchSize={case_details.EMAIL_PAGE_SIZE}']
@@ -0,0 +1,17 @@
+import pytest
+import validation
+
+@pytest.mark.parametrize('account_id, parsed', [
+    ('ABC-12345', ('ABC', '12345')),
+    ('ABC123456', ('ABC', '123456')),
+    ('12345', (None, '12345')),
+    ('05612345', (None, None)),
+    ('056-12345', ('056', '12345')),
+    ("I'm not sure", (None, None)),
+    ('', (None, None))
+])
+def test_parse_account_id(account_id, parsed, monkeypatch):
+    # Parsing is pure: it never consults the OpCo registry
+    monkeypatch.setattr(validation, 'get_opco_registry', lambda: pytest.fail('registry consulted'))
+
+    assert validation.parse_account_id(account_id) == parsed
@@ -0,0 +1,137 @@
+import threading
+import pytest
+from reference_cache import ReferenceCache, InProcessRedis, NOT_FOUND
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Loader:
+    """Counts calls and returns the next value"""
+
+    def __init__(self, value='value'):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def make_cache(clock, **kwargs):
+    kwargs.setdefault('ttls', {'account': 60})
+    return ReferenceCache(negative_ttl=10, clock=clock, **kwargs)
+
+def test_entries_expire_after_their_entity_ttl(clock):
+    cache = make_cache(clock)
+    load = Loader()
+
+    assert cache.get_or_load('account', 'A1', load) == 'value'
+    clock.now += 59
+    assert cache.get_or_load('account', 'A1', load) == 'value'
+    assert load.calls == 1
+
+    clock.now += 1
+    cache.get_or_load('account', 'A1', load)
+    assert load.calls == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'entries': 1}
+
+def test_not_found_uses_the_negative_ttl(clock):
+    cache = make_cache(clock)
+    load = Loader(NOT_FOUND)
+
+    assert cache.get_or_load('account', 'A1', load) is NOT_FOUND
+    clock.now += 9
+    assert cache.get_or_load('account', 'A1', load) is NOT_FOUND
+    assert load.calls == 1
+
+    clock.now += 1
+    cache.get_or_load('account', 'A1', load)
+    assert load.calls == 2
+
+def test_lookup_errors_are_not_cached(clock):
+    cache = make_cache(clock)
+
+    def failing():
+        raise Exception('gateway down')
+
+    with pytest.raises(Exception):
+        cache.get_or_load('account', 'A1', failing)
+    assert cache.get_or_load('account', 'A1', Loader()) == 'value'
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = make_cache(clock, max_entries=2)
+    loads = {key: Loader(key) for key in ('A1', 'A2', 'A3')}
+
+    cache.get_or_load('account', 'A1', loads['A1'])
+    cache.get_or_load('account', 'A2', loads['A2'])
+    cache.get_or_load('account', 'A1', loads['A1'])
+    cache.get_or_load('account', 'A3', loads['A3'])
+
+    cache.get_or_load('account', 'A1', loads['A1'])
+    cache.get_or_load('account', 'A2', loads['A2'])
+    assert loads['A1'].calls == 1
+    assert loads['A2'].calls == 2
+
+def test_shared_backend_serves_other_instances(clock):
+    shared = InProcessRedis(clock=clock)
+    first = make_cache(clock, shared=shared)
+    second = make_cache(clock, shared=shared)
+    load = Loader({'Name': 'Acme'})
+    missing = Loader(NOT_FOUND)
+
+    first.get_or_load('account', 'A1', load)
+    first.get_or_load('account', 'A2', missing)
+    assert second.get_or_load('account', 'A1', load) == {'Name': 'Acme'}
+    assert second.get_or_load('account', 'A2', missing) is NOT_FOUND
+    assert load.calls == 1
+    assert missing.calls == 1
+
+    # The shared copy expires with the same TTL
+    clock.now += 60
+    make_cache(clock, shared=shared).get_or_load('account', 'A1', load)
+    assert load.calls == 2
+
+def test_invalidate_drops_local_and_shared_copies(clock):
+    shared = InProcessRedis(clock=clock)
+    cache = make_cache(clock, shared=shared)
+    load = Loader()
+
+    cache.get_or_load('account', 'A1', load)
+    cache.invalidate('account', 'A1')
+    make_cache(clock, shared=shared).get_or_load('account', 'A1', load)
+    assert load.calls == 2
+
+def test_unavailable_shared_backend_falls_back_to_loading(clock):
+    class DownRedis:
+        def get(self, key):
+            raise ConnectionError('down')
+
+        def set(self, key, value, ex=None):
+            raise ConnectionError('down')
+
+    cache = make_cache(clock, shared=DownRedis())
+    assert cache.get_or_load('account', 'A1', Loader()) == 'value'
+    assert cache.get_or_load('account', 'A1', Loader()) == 'value'
+
+def test_counters_are_exact_under_concurrency(clock):
+    cache = make_cache(clock)
+    cache.get_or_load('account', 'A1', Loader())
+
+    def read():
+        for _ in range(1000):
+            cache.get_or_load('account', 'A1', Loader())
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats() == {'hits': 8000, 'misses': 1, 'entries': 1}
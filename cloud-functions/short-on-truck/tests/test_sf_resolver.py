@@ -0,0 +1,144 @@
+import re
+import copy
+import pytest
+from urllib.parse import unquote
+import http_client
+import token_cache
+import validation
+from reference_cache import ReferenceCache
+from sf_resolver import SalesforceResolver
+
+# sobject -> normalised filter -> records
+SALESFORCE = {
+    'Invoice__c': {
+        "Invoice_Number__c='INV1'": [{'Account__c': 'ABC-12345'}],
+        "Invoice_Number__c='INV2'": [{'Account__c': 'ABC-12345'}],
+        "Invoice_Number__c='INV4'": [{'Account__c': 'XYZ-67890'}]
+    },
+    'Invoice_Line_Item__c': {
+        "Invoice__c.Invoice_Number__c='INV1'": [
+            {'SUPC__c': 'S00001', 'Invoice__r': {'Account__c': 'ABC-12345'}},
+            {'SUPC__c': 'S00002', 'Invoice__r': {'Account__c': 'ABC-12345'}}
+        ],
+        "Invoice__c.Invoice_Number__c='INV2'": [{'SUPC__c': 'S00009', 'Invoice__r': {'Account__c': 'ABC-12345'}}]
+    },
+    'Account': {
+        "Account_ID__c='ABC-12345'": [{'Account_ID__c': 'ABC-12345', 'Name': 'Acme', 'OpCo__c': 'ABC'}],
+        "Account_ID__c='XYZ-67890'": [{'Account_ID__c': 'XYZ-67890', 'Name': 'Zenith', 'OpCo__c': 'XYZ'}],
+        "Account_Number__c='12345'": [{'OpCo__c': 'ABC', 'Name': 'Acme'}],
+        "Account_Number__c='55555'": [{'OpCo__c': 'ABC', 'Name': 'A'}, {'OpCo__c': 'XYZ', 'Name': 'B'}]
+    },
+    'OpCo__c': {
+        "OpCo_ID__c='ABC'": [{'OpCo_ID__c': 'ABC'}],
+        "OpCo_ID__c='XYZ'": [{'OpCo_ID__c': 'XYZ'}]
+    }
+}
+
+AGENT_RESPONSES = [
+    [{'CustomerNumber_AccountId': 'ABC-12345', 'OpCoCode': 'ABC', 'CreditRequests': [{'InvoiceNumber': 'INV1', 'SUPC': 'S00001', 'MissingQuantity': '2'}]}],
+    [{'CustomerNumber_AccountId': 'ABC12345', 'CreditRequests': [{'InvoiceNumber': 'INV1', 'SUPC': "I'm not sure"}]}],
+    [{'CustomerNumber_AccountId': "I'm not sure", 'CreditRequests': [{'InvoiceNumber': 'INV1', 'SUPC': ''}]}],
+    [{'CustomerNumber_AccountId': "I'm not sure", 'CreditRequests': [{'InvoiceNumber': 'INV2', 'SUPC': ''}]}],
+    [{'CustomerNumber_AccountId': "I'm not sure", 'CreditRequests': [{'InvoiceNumber': 'INV4', 'SUPC': 'S1'}]}],
+    [{'CustomerNumber_AccountId': '12345', 'OpCoCode': "I'm not sure", 'CustomerName': 'x', 'CreditRequests': []}],
+    [{'CustomerNumber_AccountId': '55555', 'CreditRequests': []}],
+    [{'CustomerNumber_AccountId': 'XYZ-99999', 'OpCoCode': 'ABC', 'CreditRequests': [{'InvoiceNumber': 'INV1', 'SUPC': 'S1'}]}],
+    [{'CustomerNumber_AccountId': "I'm not sure", 'CreditRequests': [{'InvoiceNumber': 'INV9', 'SUPC': ''}]}]
+]
+
+def lookup(sobject, filters):
+    return SALESFORCE.get(sobject, {}).get(re.sub(r'\s*=\s*', '=', filters), [])
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+class FakeSalesforce:
+    """Gateway query endpoint for legacy mode, plus the query/composite callables a resolver accepts"""
+
+    def __init__(self, composite_fails=False):
+        self.composite_fails = composite_fails
+        self.queries = []
+        self.composites = []
+
+    def request(self, method, url, headers=None, params=None, **kwargs):
+        sobject = url.split('/sobjects/', 1)[1].split('/')[0]
+        return FakeResponse(200, self.query(sobject, params['fields'], params['filters']))
+
+    def query(self, sobject, fields, filters):
+        self.queries.append((sobject, filters))
+        records = lookup(sobject, filters)
+        return {'totalSize': len(records), 'records': copy.deepcopy(records), 'done': True}
+
+    def composite(self, subrequests):
+        self.composites.append(subrequests)
+        if self.composite_fails:
+            raise Exception('Composite request failed: 503')
+        responses = []
+        for subrequest in subrequests:
+            soql = unquote(subrequest['url'].split('q=', 1)[1])
+            sobject, filters = re.match(r'SELECT .* FROM (\w+) WHERE (.*)$', soql).groups()
+            records = lookup(sobject, filters)
+            responses.append({'referenceId': subrequest['referenceId'], 'httpStatusCode': 200, 'body': {'totalSize': len(records), 'records': copy.deepcopy(records)}})
+        return responses
+
+class FakeOpcoRegistry:
+    def contains(self, opco_id):
+        return opco_id in ('ABC', 'XYZ')
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(token_cache, 'get_token', lambda profile='salesforce': {'access_token': 'token'})
+    monkeypatch.setattr(validation, 'get_opco_registry', lambda: FakeOpcoRegistry())
+    monkeypatch.setattr(validation, 'RESOLVER_MODE', 'legacy')
+
+def strip_timings(value):
+    if isinstance(value, dict):
+        return {key: strip_timings(item) for key, item in value.items() if key != 'timings'}
+    if isinstance(value, list):
+        return [strip_timings(item) for item in value]
+    return value
+
+def validate(monkeypatch, agent_response, mode=None, salesforce=None):
+    """validate_agent_response with a cold reference cache, in legacy mode or with a resolver in mode"""
+    salesforce = salesforce or FakeSalesforce()
+    cache = ReferenceCache()
+    monkeypatch.setattr(validation, 'get_reference_cache', lambda: cache)
+    monkeypatch.setattr(http_client, 'request', salesforce.request)
+    resolver = None
+    if mode is not None:
+        resolver = SalesforceResolver({}, mode=mode, query=salesforce.query, composite=salesforce.composite)
+    result = validation.validate_agent_response({'agent_response': copy.deepcopy(agent_response)}, {'created_date': '2030-01-10'}, resolver)
+    return strip_timings(result)
+
+@pytest.mark.parametrize('mode', ['merged', 'composite'])
+@pytest.mark.parametrize('agent_response', AGENT_RESPONSES)
+def test_resolver_matches_legacy(monkeypatch, mode, agent_response):
+    assert validate(monkeypatch, agent_response, mode) == validate(monkeypatch, agent_response)
+
+@pytest.mark.parametrize('agent_response', AGENT_RESPONSES)
+def test_composite_failure_falls_back_to_queries(monkeypatch, agent_response):
+    salesforce = FakeSalesforce(composite_fails=True)
+
+    assert validate(monkeypatch, agent_response, 'composite', salesforce) == validate(monkeypatch, agent_response)
+
+def test_composite_prefetch_replaces_the_queries(monkeypatch):
+    salesforce = FakeSalesforce()
+
+    validate(monkeypatch, AGENT_RESPONSES[0], 'composite', salesforce)
+
+    assert len(salesforce.composites) == 1
+    assert salesforce.queries == []
+
+def test_invoice_without_lines_falls_back_to_invoice_query(monkeypatch):
+    salesforce = FakeSalesforce()
+
+    result = validate(monkeypatch, AGENT_RESPONSES[4], 'merged', salesforce)
+
+    assert result['validated_data']['account_id'] == 'XYZ-67890'
+    assert ('Invoice__c', "Invoice_Number__c='INV4'") in salesforce.queries
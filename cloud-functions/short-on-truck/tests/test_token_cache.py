@@ -0,0 +1,130 @@
+import time
+import threading
+import pytest
+import http_client
+import token_cache
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data or {}
+        self.text = str(data)
+        self.closed = False
+
+    def json(self):
+        return self._data
+
+    def close(self):
+        self.closed = True
+
+class FakeGateway:
+    """Token endpoint issuing numbered tokens, and an API that accepts only the tokens in valid"""
+
+    def __init__(self, expires_in=3600, delay=0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.token_posts = 0
+        self.valid = set()
+        self.responses = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, **kwargs):
+        if url.endswith('/token'):
+            time.sleep(self.delay)
+            with self._lock:
+                self.token_posts += 1
+                token = f'token-{self.token_posts}'
+            self.valid.add(token)
+            return FakeResponse(200, {'access_token': token, 'expires_in': self.expires_in})
+        token = headers['Authorization'].split(' ', 1)[1]
+        response = FakeResponse(200 if token in self.valid else 401, {'token': token})
+        self.responses.append(response)
+        return response
+
+@pytest.fixture
+def gateway(monkeypatch):
+    fake = FakeGateway()
+    monkeypatch.setattr(token_cache, '_tokens', {})
+    monkeypatch.setattr(http_client, 'request', fake.request)
+    return fake
+
+def test_concurrent_callers_share_one_token_fetch(gateway):
+    gateway.delay = 0.05
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(token_cache.get_token()['access_token'])) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert gateway.token_posts == 1
+    assert set(tokens) == {'token-1'}
+
+def test_cached_token_is_reused_until_refresh_margin(gateway, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(token_cache.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(token_cache, 'REFRESH_MARGIN_SECONDS', 60)
+
+    token_cache.get_token()
+    clock[0] += 3600 - 61
+    token_cache.get_token()
+    assert gateway.token_posts == 1
+
+    clock[0] += 1
+    assert token_cache.get_token()['access_token'] == 'token-2'
+
+def test_short_lived_token_counts_as_fresh(gateway, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(token_cache.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(token_cache, 'REFRESH_MARGIN_SECONDS', 60)
+    gateway.expires_in = 30
+
+    token_cache.get_token()
+    clock[0] += 14
+    token_cache.get_token()
+    assert gateway.token_posts == 1
+
+    clock[0] += 1
+    token_cache.get_token()
+    assert gateway.token_posts == 2
+
+def test_missing_or_invalid_expires_in_uses_default(gateway, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(token_cache.time, 'monotonic', lambda: clock[0])
+    gateway.expires_in = 'soon'
+
+    token_cache.get_token()
+    clock[0] += token_cache.DEFAULT_EXPIRES_IN / 2 - 1
+    token_cache.get_token()
+    assert gateway.token_posts == 1
+
+def test_401_invalidates_and_retries_once(gateway):
+    token_cache.get_token()
+    gateway.valid.clear()
+
+    response = token_cache.authorized_request('GET', 'http://gateway.test/api')
+
+    assert response.status_code == 200
+    assert response.json() == {'token': 'token-2'}
+    assert gateway.token_posts == 2
+    assert [r.status_code for r in gateway.responses] == [401, 200]
+    assert gateway.responses[0].closed
+
+def test_concurrent_401s_trigger_a_single_refresh(gateway):
+    token_cache.get_token()
+    gateway.valid.clear()
+    barrier = threading.Barrier(8)
+    statuses = []
+
+    def call():
+        barrier.wait()
+        statuses.append(token_cache.authorized_request('GET', 'http://gateway.test/api').status_code)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 8
+    assert gateway.token_posts == 2
@@ -0,0 +1,111 @@
+import time
+import threading
+import http_client
+from settings import get_settings
+
+
+# Refresh tokens this many seconds before the gateway-reported expiry
+REFRESH_MARGIN_SECONDS = get_settings().token_refresh_margin_seconds
+
+# Lifetime assumed when the token response carries no expires_in
+DEFAULT_EXPIRES_IN = 300
+
+# (gateway_url, client_id) -> {'token': token_response, 'refresh_at': monotonic seconds}
+_tokens = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+def get_credentials(profile='salesforce'):
+    """Resolve gateway URL and client credentials for a token profile"""
+    settings = get_settings()
+    if profile == 'ces':
+        return settings.ces_gateway_url, settings.ces_client_id, settings.ces_client_secret
+    return settings.gateway_url, settings.client_id, settings.client_secret
+
+def fetch_token(gateway_url, client_id, client_secret):
+    """Request a new OAuth token using client credentials via API gateway"""
+    token_url = f"{gateway_url}/token"
+
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    data = {
+        'grant_type': 'client_credentials',
+        'client_id': client_id,
+        'client_secret': client_secret
+    }
+
+    response = http_client.request('POST', token_url, headers=headers, data=data)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"Failed to get token: {response.text}")
+
+def _key_lock(key):
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+def _is_fresh(entry):
+    return entry is not None and time.monotonic() < entry['refresh_at']
+
+def get_token(profile='salesforce'):
+    """Get a cached OAuth token, fetching a new one only when missing or close to expiry"""
+    gateway_url, client_id, client_secret = get_credentials(profile)
+    key = (gateway_url, client_id)
+
+    entry = _tokens.get(key)
+    if _is_fresh(entry):
+        return entry['token']
+
+    # Single-flight: one caller refreshes, concurrent callers wait and reuse its token
+    with _key_lock(key):
+        entry = _tokens.get(key)
+        if _is_fresh(entry):
+            return entry['token']
+
+        token_response = fetch_token(gateway_url, client_id, client_secret)
+        try:
+            expires_in = int(token_response.get('expires_in') or DEFAULT_EXPIRES_IN)
+        except (ValueError, TypeError):
+            expires_in = DEFAULT_EXPIRES_IN
+        # Short-lived tokens are refreshed halfway through instead of never counting as fresh
+        margin = min(REFRESH_MARGIN_SECONDS, expires_in / 2)
+        _tokens[key] = {'token': token_response, 'refresh_at': time.monotonic() + expires_in - margin}
+        return token_response
+
+def invalidate_token(profile='salesforce', access_token=None):
+    """Drop a cached token so the next caller fetches a new one.
+
+    When access_token is given, the entry is only dropped if it still holds that
+    token, so callers that all saw the same 401 trigger a single refresh.
+    """
+    gateway_url, client_id, _ = get_credentials(profile)
+    key = (gateway_url, client_id)
+    with _key_lock(key):
+        entry = _tokens.get(key)
+        if entry and (access_token is None or entry['token'].get('access_token') == access_token):
+            del _tokens[key]
+
+def get_oauth_token():
+    """Get OAuth token for Salesforce APIs"""
+    return get_token('salesforce')
+
+def get_ces_oauth_token():
+    """Get OAuth token for CES APIs (prod)"""
+    return get_token('ces')
+
+def authorized_request(method, url, profile='salesforce', headers=None, **kwargs):
+    """Send a gateway request with a cached bearer token, refreshing it once on 401"""
+    headers = dict(headers or {})
+    access_token = get_token(profile)['access_token']
+    headers['Authorization'] = f'Bearer {access_token}'
+
+    response = http_client.request(method, url, headers=headers, **kwargs)
+    if response.status_code == 401:
+        # Release the rejected response's connection before retrying
+        response.close()
+        invalidate_token(profile, access_token)
+        headers['Authorization'] = f"Bearer {get_token(profile)['access_token']}"
+        response = http_client.request(method, url, headers=headers, **kwargs)
+    return response
@@ -1,12 +1,68 @@
 
-import os
-import requests
-import json
+import time
 import functions_framework
-from datetime import datetime, timedelta, date
-from dotenv import load_dotenv
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+from token_cache import get_oauth_token, get_ces_oauth_token, authorized_request
+from fetch_cache import FetchCache
+from invoice_index import InvoiceIndex, CreditHistoryIndex, RequestedQtyIndex
+from ces_records import ScannedLine, EligibilityResult, PendingCredit
+from reference_cache import get_reference_cache, NOT_FOUND
+from opco_registry import get_opco_registry
+from sf_query import query_records
+from sf_resolver import SalesforceResolver, RESOLVER_MODE
+from ces_payload import parse_items_payload, STREAMING_PARSE
+from settings import get_settings
 
-load_dotenv()
+
+# Upper bound on concurrent Salesforce lookups per agent response
+VALIDATION_MAX_WORKERS = get_settings().validation_max_workers
+
+# Credit lines evaluated concurrently per case; 1 evaluates them serially
+CES_MAX_WORKERS = get_settings().ces_max_workers
+
+# Rows requested per page of a customer's credit history; longer histories are read page by page
+CES_HISTORY_PAGE_SIZE = get_settings().ces_history_page_size
+
+# Cases validated concurrently by send_to_validation_batch
+VALIDATION_BATCH_MAX_WORKERS = get_settings().validation_batch_max_workers
+
+# 'lean' returns only the credits_eligibility fields; 'full' adds evaluation details and source lines for debugging
+OUTPUT_PROFILES = ('lean', 'full')
+DEFAULT_OUTPUT_PROFILE = get_settings().validation_output_profile
+
+# validate_agent_response fields returned under the full profile
+VALIDATION_DEBUG_FIELDS = ('account_validation', 'opco_validation', 'resolved_account_id', 'resolved_opco', 'multiple_opcos', 'timings')
+
+def resolve_output_profile(request_json):
+    """Output profile requested by the caller, falling back to the configured default"""
+    output_profile = (request_json or {}).get('output_profile') or DEFAULT_OUTPUT_PROFILE
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"output_profile must be one of {', '.join(OUTPUT_PROFILES)}")
+    return output_profile
+
+INVALID_ACCOUNT_RESULT = "Validation failed as given accountId/opcode is invalid"
+
+def validation_debug(validation_results):
+    """validate_agent_response fields reported under the full profile"""
+    return {key: validation_results[key] for key in VALIDATION_DEBUG_FIELDS if key in validation_results}
+
+def validate_case(agent_response_data, case_details, fetch_cache, output_profile='lean'):
+    """Validate one case and check credit eligibility, returning the send_to_validation response body"""
+    # Advanced validation with data resolution
+    validation_results = validate_agent_response(agent_response_data, case_details)
+    
+    if not validation_results.get('overall_valid', False):
+        result = {"Invoice_results": INVALID_ACCOUNT_RESULT}
+    else:
+        # Process CES validation
+        sf_Details = validation_results['validated_data']
+        ces_results = ces_process_credit_eligibility(sf_Details, fetch_cache, output_profile=output_profile)
+        result = {"Invoice_results": ces_results}
+    
+    if output_profile == 'full':
+        result["validation"] = validation_debug(validation_results)
+    return result
 
 @functions_framework.http
 def send_to_validation(request):
@@ -22,98 +78,142 @@ def send_to_validation(request):
         if not agent_response_data:
             return {"error": "No agent response data provided"}, 400
         
-        # Advanced validation with data resolution
-        validation_results = validate_agent_response(agent_response_data, case_details)
-        
-        if not validation_results.get('overall_valid', False):
-            return {"Invoice_results": "Validation failed as given accountId/opcode is invalid"}
+        try:
+            output_profile = resolve_output_profile(request_json)
+        except ValueError as e:
+            return {"error": str(e)}, 400
         
-        # Process CES validation
-        sf_Details = validation_results['validated_data']
-        ces_results = ces_process_credit_eligibility(sf_Details)
-        return {"Invoice_results": ces_results}
+        fetch_cache = FetchCache()
+        result = validate_case(agent_response_data, case_details, fetch_cache, output_profile)
+        if isinstance(result.get("Invoice_results"), list):
+            result["metadata"] = {"ces_fetch_cache": fetch_cache.stats()}
+        return result
         
     except Exception as e:
         return {"error": str(e)}, 500
 
-def get_oauth_token():
-    """Get OAuth token for Salesforce APIs"""
-    token_url = f"{os.getenv('GATEWAY_URL')}/token"
-   
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': os.getenv('CLIENT_ID'),
-        'client_secret': os.getenv('CLIENT_SECRET')
-    }
-   
-    response = requests.post(token_url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to get token: {response.text}")
-
-def get_ces_oauth_token():
-    """Get OAuth token for CES APIs (prod)"""
-    token_url = f"{os.getenv('CES_GATEWAY_URL', os.getenv('GATEWAY_URL'))}/token"
-   
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = {
-        'grant_type': 'client_credentials',
-        'client_id': os.getenv('CES_CLIENT_ID', os.getenv('CLIENT_ID')),
-        'client_secret': os.getenv('CES_CLIENT_SECRET', os.getenv('CLIENT_SECRET'))
-    }
-   
-    response = requests.post(token_url, headers=headers, data=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to get CES token: {response.text}")
+@functions_framework.http
+def send_to_validation_batch(request):
+    """HTTP Cloud Function validating many cases in one call with shared CES fetches"""
+    try:
+        request_json = request.get_json(silent=True)
+        if not request_json:
+            return {"error": "No case details provided"}, 400
+        
+        items = request_json.get('items')
+        if not items or not isinstance(items, list):
+            return {"error": "No items provided"}, 400
+        
+        try:
+            output_profile = resolve_output_profile(request_json)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        
+        # Each case runs up to VALIDATION_MAX_WORKERS Salesforce lookups; keep the total within the connection pool
+        batch_workers = max(1, min(VALIDATION_BATCH_MAX_WORKERS, get_settings().http_pool_size // VALIDATION_MAX_WORKERS))
+        
+        def validate_item(item):
+            case_details = item.get('case_details') if isinstance(item, dict) else None
+            result = {"case_id": case_details.get('id') if isinstance(case_details, dict) else None}
+            try:
+                agent_response_data = item.get('agent_response_data') if isinstance(item, dict) else None
+                if not agent_response_data:
+                    result["error"] = "No agent response data provided"
+                    return result, None
+                validation_results = validate_agent_response(agent_response_data, case_details)
+                if output_profile == 'full':
+                    result["validation"] = validation_debug(validation_results)
+                if not validation_results.get('overall_valid', False):
+                    result["Invoice_results"] = INVALID_ACCOUNT_RESULT
+                    return result, None
+                return result, validation_results['validated_data']
+            except Exception as e:
+                result["error"] = str(e)
+                return result, None
+        
+        validated = _map_bounded(validate_item, items, batch_workers)
+        
+        # Every valid case goes through one eligibility pass, so CES invoice fetches and each
+        # customer's credit history are shared across the whole batch rather than fetched per case
+        fetch_cache = FetchCache()
+        pending = [(result, sf_Details) for result, sf_Details in validated if sf_Details is not None]
+        outcomes = ces_process_credit_eligibility([sf_Details for _, sf_Details in pending], fetch_cache, output_profile=output_profile, per_entry=True) if pending else []
+        for (result, _), outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                result["error"] = str(outcome)
+            else:
+                result["Invoice_results"] = outcome
+        
+        # Keep Invoice_results ahead of the debug block, as in send_to_validation
+        results = []
+        for result, _ in validated:
+            if "validation" in result:
+                result["validation"] = result.pop("validation")
+            results.append(result)
+        return {
+            "results": results,
+            "metadata": {
+                "case_count": len(items),
+                "failed_cases": len([r for r in results if "error" in r]),
+                "ces_fetch_cache": fetch_cache.stats()
+            }
+        }
+        
+    except Exception as e:
+        return {"error": str(e)}, 500
 
-def ces_get_first_invoice_details(invoice_num, OpCo):
+def ces_get_first_invoice_details(invoice_num, OpCo, cache=None):
     """Validate invoice number"""
+    if cache is not None:
+        return cache.get_or_fetch(('invoice', OpCo, invoice_num), lambda: ces_get_first_invoice_details(invoice_num, OpCo))
     try:
         token_response = get_ces_oauth_token()
         headers = {'Authorization': f'Bearer {token_response["access_token"]}', 'accept': 'application/json'}
-        url = f"{os.getenv('CES_GATEWAY_URL', os.getenv('GATEWAY_URL'))}/services/enterprise-invoice-service-v2/invoice/details/opcos/{OpCo}/invoices/{invoice_num}"
+        url = f"{get_settings().ces_gateway_url}/services/enterprise-invoice-service-v2/invoice/details/opcos/{OpCo}/invoices/{invoice_num}"
         params = {"page_size" : 10000}
-        response = requests.get(url, headers=headers, params=params)
+        response = authorized_request('GET', url, profile='ces', headers=headers, params=params, stream=STREAMING_PARSE)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_items_payload(response)
             if data and data.get('totalItems') > 0:
                 return data
             else:
                 return {"items": []}
         else:
+            # Streamed responses hold their connection until closed
+            response.close()
             return {"items": []}
     except Exception as e:
         return {"items": [], "error": str(e)}
  
-def validate_account(account_id, headers):
+def validate_account(account_id, headers, resolver=None):
     """Validate account ID"""
+    def load():
+        if resolver is not None:
+            data = resolver.account(account_id)
+        else:
+            data = query_records('Account', 'Account_ID__c', f"Account_ID__c='{account_id}'", headers)
+        if data.get('totalSize', 0) > 0 and data['records'][0]['Account_ID__c'] == account_id:
+            return True
+        return NOT_FOUND
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Account/query"
-        params = {'fields': 'Account_ID__c', 'filters': f"Account_ID__c='{account_id}'"}
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('totalSize', 0) > 0:
-                return data['records'][0]['Account_ID__c'] == account_id
-        return False
+        return get_reference_cache().get_or_load('account', account_id, load) is True
     except:
         return False
 
 def validate_opco(opco_id, headers):
     """Validate OpCo code"""
+    # Known OpCos are answered from the preloaded registry; anything else (including
+    # OpCos added since the last refresh) falls back to the cached live query
+    if get_opco_registry().contains(opco_id):
+        return True
+    
+    def load():
+        data = query_records('OpCo__c', 'OpCo_ID__c', f"OpCo_ID__c = '{opco_id}'", headers)
+        if data.get('totalSize', 0) > 0 and data['records'][0]['OpCo_ID__c'] == opco_id:
+            return True
+        return NOT_FOUND
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/OpCo__c/query"
-        params = {'fields': 'OpCo_ID__c', 'filters': f"OpCo_ID__c = '{opco_id}'"}
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('totalSize', 0) > 0:
-                return data['records'][0]['OpCo_ID__c'] == opco_id
-        return False
+        return get_reference_cache().get_or_load('opco', opco_id, load) is True
     except:
         return False
 
@@ -153,12 +253,14 @@ def build_account_id(opco, account_num):
         return f"{opco}-{account_num}"
     return None
 
-def get_account_from_invoice(invoice_num, headers):
+def get_account_from_invoice(invoice_num, headers, resolver=None):
     """Get account ID from invoice number"""
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Invoice__c/query"
+        if resolver is not None:
+            return resolver.invoice_account(invoice_num)
+        url = f"{get_settings().crm_url}/sobjects/Invoice__c/query"
         params = {'fields': 'Account__c', 'filters': f"Invoice_Number__c='{invoice_num}'"}
-        response = requests.get(url, headers=headers, params=params)
+        response = authorized_request('GET', url, headers=headers, params=params)
         if response.status_code == 200:
             data = response.json()
             if data.get('totalSize', 0) > 0:
@@ -169,29 +271,29 @@ def get_account_from_invoice(invoice_num, headers):
 
 def get_opco_from_account_number(account_num, headers, customer_name=None, invoice_num=None):
     """Get OpCo from account number with additional context"""
+    def load():
+        records = query_records('Account', 'OpCo__c, Name', f"Account_Number__c='{account_num}'", headers).get('records', [])
+        if len(records) == 1:
+            return records[0]['OpCo__c']
+        elif len(records) > 1:
+            return f"Multiple OpCos found: {[r['OpCo__c'] for r in records]}"
+        return NOT_FOUND
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Account/query"
-        params = {'fields': 'OpCo__c, Name', 'filters': f"Account_Number__c='{account_num}'"}
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            records = data.get('records', [])
-            if len(records) == 1:
-                return records[0]['OpCo__c']
-            elif len(records) > 1:
-                return f"Multiple OpCos found: {[r['OpCo__c'] for r in records]}"
-        return None
+        opco = get_reference_cache().get_or_load('account_number', account_num, load)
+        return None if opco is NOT_FOUND else opco
     except:
         return None
 
 
 
-def get_supcs_from_invoice(invoice_num, headers):
+def get_supcs_from_invoice(invoice_num, headers, resolver=None):
     """Get available SUPCs from invoice"""
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Invoice_Line_Item__c/query"
+        if resolver is not None:
+            return [record['SUPC__c'] for record in resolver.invoice_lines(invoice_num).get('records', [])]
+        url = f"{get_settings().crm_url}/sobjects/Invoice_Line_Item__c/query"
         params = {'fields': 'SUPC__c', 'filters': f"Invoice__c.Invoice_Number__c='{invoice_num}'"}
-        response = requests.get(url, headers=headers, params=params)
+        response = authorized_request('GET', url, headers=headers, params=params)
         if response.status_code == 200:
             data = response.json()
             return [record['SUPC__c'] for record in data.get('records', [])]
@@ -199,21 +301,34 @@ def get_supcs_from_invoice(invoice_num, headers):
     except:
         return []
 
-def get_customer_name_from_account(account_id, headers):
+def get_customer_name_from_account(account_id, headers, resolver=None):
     """Get customer name from account ID"""
+    def load():
+        if resolver is not None:
+            data = resolver.account(account_id)
+        else:
+            data = query_records('Account', 'Name', f"Account_ID__c='{account_id}'", headers)
+        if data.get('totalSize', 0) > 0:
+            return data['records'][0]['Name']
+        return NOT_FOUND
     try:
-        url = f"{os.getenv('GATEWAY_URL')}/system/customer-relationship-management/v3/sobjects/Account/query"
-        params = {'fields': 'Name', 'filters': f"Account_ID__c='{account_id}'"}
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('totalSize', 0) > 0:
-                return data['records'][0]['Name']
-        return None
+        name = get_reference_cache().get_or_load('account_name', account_id, load)
+        return None if name is NOT_FOUND else name
     except:
         return None
 
-def validate_agent_response(agent_response_data, case_details=None):
+def _timed(timings, started, name, fn, *args):
+    """Run one validation lookup and record when it started and how long it took"""
+    step_start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[name] = {
+            'start_ms': round((step_start - started) * 1000, 1),
+            'duration_ms': round((time.perf_counter() - step_start) * 1000, 1)
+        }
+
+def validate_agent_response(agent_response_data, case_details=None, resolver=None):
     """Advanced validation with data resolution"""
     try:
         agent_responses = agent_response_data.get('agent_response', [])
@@ -237,8 +352,7 @@ def validate_agent_response(agent_response_data, case_details=None):
             'overall_valid': True,
             'resolved_account_id': None,
             'resolved_opco': None,
-            'validated_data': {},
-            'headers': headers
+            'validated_data': {}
         }
         
         # Enhanced Account/Invoice Logic
@@ -265,61 +379,102 @@ def validate_agent_response(agent_response_data, case_details=None):
                 invoice_num = credit_request.get('InvoiceNumber')
                 break
         
-        # Get account ID if not provided
-        if not account_id or account_id == "I'm not sure":
-            if invoice_num:
-                account_id = get_account_from_invoice(invoice_num, headers)
+        credit_requests = response_data.get('CreditRequests', [])
+        customer_name = response_data.get('CustomerName')
+        
+        # Merged/composite resolution batches the Salesforce queries behind these lookups
+        if resolver is None and RESOLVER_MODE != 'legacy':
+            resolver = SalesforceResolver(headers)
+        if resolver is not None:
+            resolver.prefetch(invoice_num, account_id)
+        
+        # Independent lookups run concurrently; only the account/OpCo resolution chain is sequential
+        timings = {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=VALIDATION_MAX_WORKERS) as executor:
+            def submit(name, fn, *args):
+                return executor.submit(_timed, timings, started, name, fn, *args)
+            
+            def submit_final_lookups():
+                # Account and OpCo are final here, so their checks no longer depend on each other
+                lookups = {}
+                if account_id:
+                    lookups['validate_account'] = submit('validate_account', validate_account, account_id, headers, resolver)
+                if opco_id and opco_id != "I'm not sure":
+                    lookups['validate_opco'] = submit('validate_opco', validate_opco, opco_id, headers)
+                if (not customer_name or customer_name == "I'm not sure") and account_id:
+                    lookups['customer_name'] = submit('get_customer_name_from_account', get_customer_name_from_account, account_id, headers, resolver)
+                return lookups
+            
+            # Invoice SUPCs only depend on the invoice number
+            supcs_future = None
+            if invoice_num and any(not cr.get('SUPC') or cr.get('SUPC') == "I'm not sure" for cr in credit_requests):
+                supcs_future = submit('get_supcs_from_invoice', get_supcs_from_invoice, invoice_num, headers, resolver)
+            
+            resolve_from_invoice = (not account_id or account_id == "I'm not sure") and invoice_num
+            resolve_opco = (not opco_id or opco_id == "I'm not sure") and account_id and len(account_id) in [5, 6] and account_id.isdigit()
+            
+            # Nothing left to resolve, so validate straight away
+            final_lookups = None
+            if not resolve_from_invoice and not resolve_opco:
+                final_lookups = submit_final_lookups()
+            
+            # Get account ID if not provided
+            if resolve_from_invoice:
+                account_id = submit('get_account_from_invoice', get_account_from_invoice, invoice_num, headers, resolver).result()
                 validation_results['resolved_account_id'] = account_id
                 if account_id:
                     resolved_opco, _ = parse_account_id(account_id)
                     if resolved_opco:
                         opco_id = resolved_opco
                         validation_results['resolved_opco'] = opco_id
-        
-        # If OpCo is missing but we have account number, try to find OpCo
-        if (not opco_id or opco_id == "I'm not sure") and account_id and len(account_id) in [5, 6] and account_id.isdigit():
-            customer_name = response_data.get('CustomerName')
-            opco_result = get_opco_from_account_number(account_id, headers, customer_name, invoice_num)
-            if opco_result and not opco_result.startswith("Multiple"):
-                opco_id = opco_result
-                validation_results['resolved_opco'] = opco_id
-                account_id = build_account_id(opco_id, account_id)
-                validation_results['resolved_account_id'] = account_id
-            elif opco_result and opco_result.startswith("Multiple"):
+            
+            # If OpCo is missing but we have account number, try to find OpCo
+            if (not opco_id or opco_id == "I'm not sure") and account_id and len(account_id) in [5, 6] and account_id.isdigit():
+                opco_result = submit('get_opco_from_account_number', get_opco_from_account_number, account_id, headers, customer_name, invoice_num).result()
+                if opco_result and not opco_result.startswith("Multiple"):
+                    opco_id = opco_result
+                    validation_results['resolved_opco'] = opco_id
+                    account_id = build_account_id(opco_id, account_id)
+                    validation_results['resolved_account_id'] = account_id
+                elif opco_result and opco_result.startswith("Multiple"):
+                    validation_results['opco_validation'] = False
+                    validation_results['multiple_opcos'] = opco_result
+            
+            if final_lookups is None:
+                final_lookups = submit_final_lookups()
+            
+            # Validate resolved data
+            if 'validate_account' in final_lookups:
+                validation_results['account_validation'] = final_lookups['validate_account'].result()
+            
+            # Resolve missing SUPCs from invoice
+            if supcs_future:
+                available_supcs = supcs_future.result()
+                for i, credit_request in enumerate(credit_requests):
+                    supc = credit_request.get('SUPC')
+                    if not supc or supc == "I'm not sure":
+                        if available_supcs:
+                            credit_requests[i]['available_supcs'] = available_supcs
+                            if len(available_supcs) == 1:
+                                credit_requests[i]['SUPC'] = available_supcs[0]
+            
+            if 'validate_opco' in final_lookups:
+                validation_results['opco_validation'] = final_lookups['validate_opco'].result()
+            else:
                 validation_results['opco_validation'] = False
-                validation_results['multiple_opcos'] = opco_result
-        
-        # Validate resolved data
-        if account_id:
-            validation_results['account_validation'] = validate_account(account_id, headers)
-        
-        # Resolve missing SUPCs from invoice
-        credit_requests = response_data.get('CreditRequests', [])
-        for i, credit_request in enumerate(credit_requests):
-            supc = credit_request.get('SUPC')
-            if not supc or supc == "I'm not sure":
-                if invoice_num:
-                    available_supcs = get_supcs_from_invoice(invoice_num, headers)
-                    if available_supcs:
-                        credit_requests[i]['available_supcs'] = available_supcs
-                        if len(available_supcs) == 1:
-                            credit_requests[i]['SUPC'] = available_supcs[0]
-        
-        if opco_id and opco_id != "I'm not sure":
-            validation_results['opco_validation'] = validate_opco(opco_id, headers)
-        else:
-            validation_results['opco_validation'] = False
+            
+            # Resolve customer name if missing
+            if 'customer_name' in final_lookups:
+                customer_name = final_lookups['customer_name'].result()
         
         # Overall validation
         validation_results['overall_valid'] = (
             validation_results['account_validation'] and 
             validation_results['opco_validation']
         )
-        
-        # Resolve customer name if missing
-        customer_name = response_data.get('CustomerName')
-        if (not customer_name or customer_name == "I'm not sure") and account_id:
-            customer_name = get_customer_name_from_account(account_id, headers)
+        validation_results['timings'] = timings
+        validation_results['timings']['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
         
         # Prepare validated data
         validation_results['validated_data'] = {
@@ -338,48 +493,301 @@ def validate_agent_response(agent_response_data, case_details=None):
     except Exception as e:
         return {'valid': False, 'error': str(e)}
 
-def ces_get_scanned_invoice(invoice_number, opco_number):
+def ces_get_scanned_invoice(invoice_number, opco_number, cache=None):
     """Get scanned invoice from CES API"""
+    if cache is not None:
+        return cache.get_or_fetch(('scanned', opco_number, invoice_number), lambda: ces_get_scanned_invoice(invoice_number, opco_number))
     try:
         token_response = get_ces_oauth_token()
         headers = {'Authorization': f'Bearer {token_response["access_token"]}', 'accept': 'application/json'}
-        url = f"{os.getenv('CES_GATEWAY_URL', os.getenv('GATEWAY_URL'))}/services/enterprise-invoice-service-v2/invoice/details/opcos/{opco_number}/invoices/{invoice_number}/delivery"
+        url = f"{get_settings().ces_gateway_url}/services/enterprise-invoice-service-v2/invoice/details/opcos/{opco_number}/invoices/{invoice_number}/delivery"
         params = {"page_size" : 10000}
-        response = requests.get(url, headers=headers,params=params)
+        response = authorized_request('GET', url, profile='ces', headers=headers, params=params, stream=STREAMING_PARSE)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_items_payload(response)
             if data and data.get('totalItems', 0) > 0:
                 return data
             else:
                 return {"items": []}
         else:
+            # Streamed responses hold their connection until closed
+            response.close()
             return {"items": []}
     except Exception as e:
         return {"items": [], "error": str(e)}
-def ces_get_invoice_details(customer_number, OpCo, scheduledDeliveryDate, todayDate):
-    """Get invoice details from CES API"""
+def ces_get_invoice_details(customer_number, OpCo, scheduledDeliveryDate, todayDate, cache=None):
+    """Get invoice details from CES API, following further pages until totalItems are read"""
+    if cache is not None:
+        key = ('customer_details', OpCo, customer_number, scheduledDeliveryDate, str(todayDate))
+        return cache.get_or_fetch(key, lambda: ces_get_invoice_details(customer_number, OpCo, scheduledDeliveryDate, todayDate))
     try:
         token_response = get_ces_oauth_token()
         headers = {'Authorization': f'Bearer {token_response["access_token"]}', 'accept': 'application/json'}
-        url = f"{os.getenv('CES_GATEWAY_URL', os.getenv('GATEWAY_URL'))}/services/enterprise-invoice-service-v2/invoice/extended/details/opcos/{OpCo}/customers/{customer_number}"
-        params = {"date_from":scheduledDeliveryDate, "date_to":todayDate, "page_size" : 10000}
-        response = requests.get(url, headers=headers, params=params)
+        url = f"{get_settings().ces_gateway_url}/services/enterprise-invoice-service-v2/invoice/extended/details/opcos/{OpCo}/customers/{customer_number}"
+        params = {"date_from":scheduledDeliveryDate, "date_to":todayDate, "page_size" : CES_HISTORY_PAGE_SIZE}
+        response = authorized_request('GET', url, profile='ces', headers=headers, params=params, stream=STREAMING_PARSE)
         if response.status_code == 200:
-            data = response.json()
+            data = parse_items_payload(response)
             if data and data.get('totalItems', 0) > 0:
-                return data
+                return _read_history_pages(url, headers, params, data)
            
             else:
                 return {"items": []}
         else:
+            # Streamed responses hold their connection until closed
+            response.close()
             return {"items": []}
     except Exception as e:
         return {"items": [], "error": str(e)}
  
 
-def ces_process_credit_eligibility(sf_Details):
-    """Process credit eligibility based on business logic"""
-    results = []
+def _read_history_pages(url, headers, params, data):
+    """Append the remaining pages of a customer history to its first page.
+
+    Pages are numbered from 1. If totalItems cannot be reached (a failed or empty
+    page, or a gateway that keeps serving the first page), the payload is marked
+    'incomplete' instead of being passed on as if it were the whole history.
+    """
+    items = data['items']
+    first_item = items[0] if items else None
+    page_number = 1
+    try:
+        while len(items) < data['totalItems']:
+            page_number += 1
+            response = authorized_request('GET', url, profile='ces', headers=headers, params=dict(params, page_number=page_number), stream=STREAMING_PARSE)
+            if response.status_code != 200:
+                response.close()
+                break
+            page_items = parse_items_payload(response).get('items') or []
+            if not page_items or page_items[0] == first_item:
+                break
+            items.extend(page_items)
+    except Exception as e:
+        data['error'] = str(e)
+    if len(items) < data['totalItems']:
+        data['incomplete'] = True
+    return data
+
+def _map_bounded(fn, items, max_workers):
+    """Apply fn to items on a bounded thread pool, returning results in input order"""
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(fn, items))
+
+def get_credit_history(customer_number, opco_number, date_from, todayDate, fetch_cache):
+    """Prior-credit index for a customer's history from date_from to todayDate, fetched and built once per run"""
+    invoice_details = ces_get_invoice_details(customer_number, opco_number, date_from, todayDate, fetch_cache)
+    if invoice_details.get('incomplete'):
+        raise Exception(f"Customer history for {customer_number} is incomplete: read {len(invoice_details['items'])} of {invoice_details['totalItems']} items")
+    credit_key = ('customer_details', opco_number, customer_number, date_from, str(todayDate))
+    return fetch_cache.get_or_build(credit_key, lambda: CreditHistoryIndex(invoice_details))
+
+def _prepare_credit_request(invoice_number, supc, opco_number, caseCreationDate, fetch_cache):
+    """Run the delivery checks for one (invoice, SUPC) line.
+
+    Returns an EligibilityResult when the line is decided without the customer's
+    credit history, or a PendingCredit for _finish_credit_request otherwise.
+    """
+    try:
+        original_invoice_data = ces_get_first_invoice_details(invoice_number, opco_number, fetch_cache)
+    except Exception as e:
+        raise Exception(f"Failed to get scanned invoice data for invoice {invoice_number}: {e}")
+ 
+    if not original_invoice_data or not isinstance(original_invoice_data, dict) or not original_invoice_data.get('items'):
+        return EligibilityResult(invoice_number, supc, 'invoice data not found', False)
+ 
+    # Find matching item in invoice data by SUPC
+    invoice_index = fetch_cache.get_or_build(('invoice', opco_number, invoice_number), lambda: InvoiceIndex(original_invoice_data))
+    original_invoice_item = invoice_index.get(supc)
+ 
+    if not original_invoice_item:
+        return EligibilityResult(invoice_number, supc, 'Item not found in main invoice', False)
+ 
+    splitCode = "S" if original_invoice_item.split_code == "S" else "CS"
+ 
+    # Get scanned invoice data
+    try:
+        scanned_data = ces_get_scanned_invoice(invoice_number, opco_number, fetch_cache)
+    except Exception as e:
+        raise Exception(f"Failed to get scanned invoice data for invoice {invoice_number}: {e}")
+ 
+    # Handle scanned data not found
+    if not scanned_data or not isinstance(scanned_data, dict) or not scanned_data.get('items'):
+        return EligibilityResult(invoice_number, supc, 'Scanned data not found', False)
+ 
+    # Find matching item in scanned data by SUPC
+    scanned_index = fetch_cache.get_or_build(('scanned', opco_number, invoice_number), lambda: InvoiceIndex(scanned_data, ScannedLine))
+    scanned_item = scanned_index.get(supc)
+ 
+    if not scanned_item:
+        return EligibilityResult(invoice_number, supc, 'Item not found in scanned invoice', False)
+ 
+    # Validate scanned item data
+    try:
+        if scanned_item.error:
+            raise ValueError(scanned_item.error)
+ 
+        quantity = scanned_item.quantity
+        if quantity is None:
+            raise ValueError(f"quantity is missing in scanned item for SUPC {supc}")
+ 
+        delivered_qty = scanned_item.delivered_qty
+        rejected_qty = scanned_item.rejected_qty
+ 
+        scheduledDeliveryDate = scanned_item.scheduled_delivery_date
+        if not scheduledDeliveryDate:
+            raise ValueError(f"scheduledDeliveryDate is missing in scanned item for SUPC {supc}")
+ 
+        # Parse delivery date
+        try:
+            eligibleDate = datetime.strptime(scheduledDeliveryDate, '%Y-%m-%d')
+        except ValueError as e:
+            raise ValueError(f"Invalid scheduledDeliveryDate format for SUPC {supc}: {e}")
+ 
+    except Exception as e:
+        raise Exception(f"Error validating scanned item data for SUPC {supc}: {e}")
+ 
+    # Calculate time differences
+    duration = caseCreationDate - eligibleDate
+    hours = duration.total_seconds() / 3600
+    days = hours/24
+ 
+    # Business logic checks
+    if hours < 24:
+        return EligibilityResult(
+            invoice_number, supc, 'On Hold - Case created within 24 hours of delivery', False, splitCode,
+            quantity=quantity, delivered_rejected_sum=delivered_qty + rejected_qty, scanned_item=scanned_item
+        )
+ 
+    if days>14:
+        return EligibilityResult(
+            invoice_number, supc, 'On Hold - Case created after 14 days of delivery', False, splitCode,
+            quantity=quantity, delivered_rejected_sum=delivered_qty + rejected_qty, scanned_item=scanned_item
+        )
+ 
+    elif quantity > (delivered_qty + rejected_qty):
+        # Short on delivery, so previous credits decide it once the customer's history is loaded
+        return PendingCredit(invoice_number, supc, splitCode, scanned_item, eligibleDate)
+    else:
+        # Fully delivered/rejected
+        return EligibilityResult(
+            invoice_number, supc, 'Not eligible - the order is fully loaded on truck. Customer get delivered/rejected either partial/full order qty', False, splitCode,
+            quantity=quantity, delivered_rejected_sum=delivered_qty + rejected_qty, scanned_item=scanned_item
+        )
+
+def _prior_credits(pending, customer_number, opco_number, window, history, todayDate, fetch_cache):
+    """Credit lines for a pending line from its delivery date on, read from the customer's widest window"""
+    try:
+        if isinstance(history, Exception):
+            raise history
+        if pending.delivery_date == window:
+            return history.get(pending.invoice_number, pending.supc)
+        if history.dated:
+            return history.get(pending.invoice_number, pending.supc, since=pending.delivery_date.strftime('%Y-%m-%d'))
+        # Without an invoiceDate on every credit the window cannot be narrowed locally, so fetch the line's own
+        credit_index = get_credit_history(customer_number, opco_number, pending.scanned_item.scheduled_delivery_date, todayDate, fetch_cache)
+        return credit_index.get(pending.invoice_number, pending.supc)
+    except Exception as e:
+        raise Exception(f"Failed to get invoice details for customer {customer_number}: {e}")
+
+def _finish_credit_request(pending, credit_lines):
+    """Decide a pending line from its previous credits, returning an EligibilityResult"""
+    invoice_number, supc, splitCode, scanned_item = pending.invoice_number, pending.supc, pending.split_code, pending.scanned_item
+    quantity = scanned_item.quantity
+    delivered_qty = scanned_item.delivered_qty
+    rejected_qty = scanned_item.rejected_qty
+ 
+    # Check for refInvoice matching with status=C
+    matching_item = None
+    original_ship_qty = 0
+ 
+    for detail_item in credit_lines:
+        if detail_item.error:
+            raise ValueError(detail_item.error)
+        matching_item = detail_item
+        original_ship_qty += detail_item.original_ship_qty
+ 
+    if matching_item:
+        # Compare quantities
+        scanned_difference = (delivered_qty + rejected_qty) - quantity
+ 
+        if scanned_difference == original_ship_qty:
+            status = 'Credits not eligible as exact quantities match with previous processed credit'
+            eligible = False
+        elif scanned_difference > original_ship_qty:
+            status = 'Lesser credits eligible as partial credits are already processed'
+            eligible = True
+        else:
+            status = 'Eligible for credit'
+            eligible = True
+        return EligibilityResult(
+            invoice_number, supc, status, eligible, splitCode, scanned_difference=scanned_difference,
+            original_ship_qty=original_ship_qty, scanned_item=scanned_item, invoice_item=matching_item
+        )
+    else:
+        # No previous credits found - eligible
+        return EligibilityResult(
+            invoice_number, supc, 'Eligible for credit as no previous processed credits has found', True, splitCode,
+            quantity=quantity, delivered_rejected_sum=delivered_qty + rejected_qty, scanned_item=scanned_item
+        )
+
+def group_eligibility_results(results, requested_index, output_profile='lean'):
+    """Group (sf_Details position, result) pairs by invoice in one pass, building the credits_eligibility items"""
+    grouped_results = {}
+    for position, result in results:
+        invoice_key = result.invoice_number
+        group = grouped_results.get(invoice_key)
+        if group is None:
+            group = grouped_results[invoice_key] = {
+                "invoice": invoice_key,
+                "credits_eligibility": []
+            }
+ 
+        # Calculate sot_credits_eligible
+        scanned_item = result.scanned_item
+        quantity = scanned_item.quantity if scanned_item else 0
+        delivered_qty = scanned_item.delivered_qty if scanned_item else 0
+        rejected_qty = scanned_item.rejected_qty if scanned_item else 0
+        original_ship_qty = result.invoice_item.original_ship_qty if result.invoice_item else 0
+        sot_credits_eligible = quantity - delivered_qty - rejected_qty + original_ship_qty
+ 
+        credit_item = {
+            "SUPC": result.supc,
+            "splitCode": result.split_code,
+            "sot_credits_requested": requested_index.get(invoice_key, result.supc, position),
+            "sot_credits_eligible": sot_credits_eligible,
+            "Status": result.status,
+            "eligibility": result.eligible,
+            "OrderedQuantity": quantity,
+            "DeliveredQuantity": delivered_qty,
+            "rejectedQuantity": rejected_qty,
+            "previousCreditsAvailedQty": -original_ship_qty,
+            "deliveryDate": scanned_item.scheduled_delivery_date if scanned_item else ''
+        }
+        if output_profile == 'full':
+            credit_item["evaluation"] = result.debug_dict()
+            credit_item["evaluation"]["requested"] = requested_index.aggregate(invoice_key, result.supc)
+        group["credits_eligibility"].append(credit_item)
+ 
+    return list(grouped_results.values())
+
+def ces_process_credit_eligibility(sf_Details, fetch_cache=None, max_workers=None, output_profile='lean', per_entry=False):
+    """Process credit eligibility based on business logic.
+
+    Every sf_Details entry is processed in one pass: CES invoice fetches and line
+    evaluations are shared across entries, and each customer's credit history is
+    fetched once, from the earliest delivery date any line needs, then narrowed
+    per line by invoiceDate. The results come back as one list grouped by invoice. With per_entry, one item per sf_Details
+    entry is returned instead: that entry's grouped results, or the Exception
+    that failed it, so one bad entry does not fail the others.
+    """
+    if fetch_cache is None:
+        fetch_cache = FetchCache()
+    if max_workers is None:
+        max_workers = CES_MAX_WORKERS
+    # Every worker holds a pooled gateway connection; more workers than connections just churns them
+    max_workers = min(max_workers, get_settings().http_pool_size)
    
     try:
         if isinstance(sf_Details, dict):
@@ -389,7 +797,14 @@ def ces_process_credit_eligibility(sf_Details):
     except Exception as e:
         return {'invoice_number': '', 'data': []}
  
-    for code_data in sf_Details:
+    # Requested quantities for the output, indexed once instead of rescanned per result
+    requested_index = RequestedQtyIndex(sf_Details)
+ 
+    # (entry position, evaluation key) per request line, in input order
+    lines = []
+    entry_errors = {}
+    for position, code_data in enumerate(sf_Details):
+        entry_lines = []
         try:
             if not isinstance(code_data, dict):
                 continue
@@ -431,6 +846,7 @@ def ces_process_credit_eligibility(sf_Details):
             if not credit_requests:
                 raise ValueError(f"credit_requests is missing or empty")
  
+            # Validate every line up front; evaluation happens once all entries are read
             for j, credit_req in enumerate(credit_requests):
                 try:
                     if not isinstance(credit_req, dict):
@@ -449,285 +865,96 @@ def ces_process_credit_eligibility(sf_Details):
                         requested_qty = abs(int(qty)) if qty else 0
                     except (ValueError, TypeError):
                         raise ValueError(f"Invalid QTY format in credit_requests[{j}]: {qty}")
+                except Exception as e:
+                    raise Exception(f"Error processing credit request {j}: {e}")
+                entry_lines.append((position, (opco_number, customer_number, caseCreationDate, invoice_number, supc), j))
  
-                    try:
-                        original_invoice_data = ces_get_first_invoice_details(invoice_number, opco_number)
-                    except Exception as e:
-                        raise Exception(f"Failed to get scanned invoice data for invoice {invoice_number}: {e}")
-                   
-                    if not original_invoice_data or not isinstance(original_invoice_data, dict) or not original_invoice_data.get('items'):
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'status': 'invoice data not found',
-                            'eligible': False
-                        })
-                        continue
- 
-                    # Find matching item in scanned data by SUPC
-                    original_invoice_item = None
-                    for item in original_invoice_data.get('items', []):
-                        if item.get('itemNumber') == supc:
-                            original_invoice_item = item
-                            break
- 
-                    if not original_invoice_item:
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'status': 'Item not found in main invoice',
-                            'eligible': False
-                        })
-                        continue
+        except Exception as e:
+            if not per_entry:
+                raise Exception(f"Error processing sf_Details: {e}")
+            entry_errors[position] = Exception(f"Error processing sf_Details: {e}")
+            continue
+        lines.extend(entry_lines)
+ 
+    # Each distinct (OpCo, customer, case date, invoice, SUPC) is evaluated once, whichever entry it came from
+    first_lines = {}
+    for position, eval_key, j in lines:
+        first_lines.setdefault(eval_key, j)
+ 
+    def line_error(eval_key, e):
+        # Failures are returned rather than raised, so they can be charged to the entries that asked for the line
+        return Exception(f"Error processing sf_Details: Error processing credit request {first_lines[eval_key]}: {e}")
+ 
+    def prepare(eval_key):
+        opco_number, customer_number, caseCreationDate, invoice_number, supc = eval_key
+        try:
+            return _prepare_credit_request(invoice_number, supc, opco_number, caseCreationDate, fetch_cache)
+        except Exception as e:
+            return line_error(eval_key, e)
  
-                    try:
-                        splitCode = original_invoice_item.get('splitCode')
-                        if splitCode=="S":
-                            splitCode="S"
-                        else:
-                            splitCode="CS"
-                    except Exception as e:
-                        raise Exception(f"Error validating scanned item data for SUPC {supc}: {e}")
- 
-                    # Get scanned invoice data
-                    try:
-                        scanned_data = ces_get_scanned_invoice(invoice_number, opco_number)
-                    except Exception as e:
-                        raise Exception(f"Failed to get scanned invoice data for invoice {invoice_number}: {e}")
- 
-                    # Handle scanned data not found
-                    if not scanned_data or not isinstance(scanned_data, dict) or not scanned_data.get('items'):
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'status': 'Scanned data not found',
-                            'eligible': False
-                        })
-                        continue
- 
-                    # Find matching item in scanned data by SUPC
-                    scanned_item = None
-                    for item in scanned_data.get('items', []):
-                        if item.get('itemNumber') == supc:
-                            scanned_item = item
-                            break
- 
-                    if not scanned_item:
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'status': 'Item not found in scanned invoice',
-                            'eligible': False
-                        })
-                        continue
- 
-                    # Validate scanned item data
-                    try:
-                        quantity = scanned_item.get('quantity')
-                        if quantity is None:
-                            raise ValueError(f"quantity is missing in scanned item for SUPC {supc}")
-                        quantity = int(quantity)
+    line_results = dict(zip(first_lines, _map_bounded(prepare, list(first_lines), max_workers)))
  
-                        delivered_qty = scanned_item.get('deliveredItemQty', 0)
-                        delivered_qty = int(delivered_qty) if delivered_qty is not None else 0
+    # One history window per (OpCo, customer), from the earliest delivery date of a line that needs it
+    todayDate = date.today()
+    history_windows = {}
+    for eval_key, result in line_results.items():
+        if isinstance(result, PendingCredit):
+            customer_key = (eval_key[0], eval_key[1])
+            history_windows[customer_key] = min(history_windows.get(customer_key, result.delivery_date), result.delivery_date)
  
-                        rejected_qty = scanned_item.get('rejectedItemQty', 0)
-                        rejected_qty = int(rejected_qty) if rejected_qty is not None else 0
+    def load_history(customer_key):
+        opco_number, customer_number = customer_key
+        try:
+            return get_credit_history(customer_number, opco_number, history_windows[customer_key].strftime('%Y-%m-%d'), todayDate, fetch_cache)
+        except Exception as e:
+            return e
  
-                        scheduledDeliveryDate = scanned_item.get('scheduledDeliveryDate')
-                        if not scheduledDeliveryDate:
-                            raise ValueError(f"scheduledDeliveryDate is missing in scanned item for SUPC {supc}")
+    histories = dict(zip(history_windows, _map_bounded(load_history, list(history_windows), max_workers)))
  
-                        # Parse delivery date
-                        try:
-                            eligibleDate = datetime.strptime(scheduledDeliveryDate, '%Y-%m-%d')
-                        except ValueError as e:
-                            raise ValueError(f"Invalid scheduledDeliveryDate format for SUPC {supc}: {e}")
- 
-                    except Exception as e:
-                        raise Exception(f"Error validating scanned item data for SUPC {supc}: {e}")
- 
-                    # Calculate time differences
-                    todayDate = date.today()
-                    duration = caseCreationDate - eligibleDate
-                    hours = duration.total_seconds() / 3600
-                    days = hours/24
-                    
-                    # Business logic checks
-                    if hours < 24:
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'splitCode': splitCode,
-                            'status': 'On Hold - Case created within 24 hours of delivery',
-                            'eligible': False,
-                            'quantity': quantity,
-                            'delivered_rejected_sum': delivered_qty + rejected_qty,
-                            'scanned_item': scanned_item,
-                            'invoice_item': None
-                        })
-                        continue
- 
-                    if days>14:
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'splitCode': splitCode,
-                            'status': 'On Hold - Case created after 14 days of delivery',
-                            'eligible': False,
-                            'quantity': quantity,
-                            'delivered_rejected_sum': delivered_qty + rejected_qty,
-                            'scanned_item': scanned_item,
-                            'invoice_item': None
-                        })
-                        continue
- 
-                    elif quantity > (delivered_qty + rejected_qty):
-                        # Get invoice details for customer
-                        try:
-                            invoice_details = ces_get_invoice_details(customer_number, opco_number, scheduledDeliveryDate, todayDate)
-                        except Exception as e:
-                            raise Exception(f"Failed to get invoice details for customer {customer_number}: {e}")
- 
-                        # Check for refInvoice matching with status=C
-                        ref_invoice_found = False
-                        matching_item = None
-                        original_ship_qty = 0
- 
-                        for detail_item in invoice_details.get('items', []):
-                            if (detail_item.get('invoiceRefNumber') == invoice_number and
-                                detail_item.get('itemNumber') == supc and
-                                detail_item.get('transCode') == 'C'):
-                               
-                                ref_invoice_found = True
-                                matching_item = detail_item
-                                ship_qty = detail_item.get('originalShipQty', 0)
-                                try:
-                                    original_ship_qty += int(ship_qty) if ship_qty is not None else 0
-                                except (ValueError, TypeError):
-                                    raise ValueError(f"Invalid originalShipQty format: {ship_qty}")
- 
-                        if ref_invoice_found and matching_item:
-                            # Compare quantities
-                            scanned_difference = (delivered_qty + rejected_qty) - quantity
-                           
-                            if scanned_difference == original_ship_qty:
-                                results.append({
-                                    'invoice_number': invoice_number,
-                                    'supc': supc,
-                                    'splitCode': splitCode,
-                                    'status': 'Credits not eligible as exact quantities match with previous processed credit',
-                                    'eligible': False,
-                                    'scanned_difference': scanned_difference,
-                                    'original_ship_qty': original_ship_qty,
-                                    'scanned_item': scanned_item,
-                                    'invoice_item': matching_item
-                                })
-                            elif scanned_difference > original_ship_qty:
-                                results.append({
-                                    'invoice_number': invoice_number,
-                                    'supc': supc,
-                                    'splitCode': splitCode,
-                                    'status': 'Lesser credits eligible as partial credits are already processed',
-                                    'eligible': True,
-                                    'scanned_difference': scanned_difference,
-                                    'original_ship_qty': original_ship_qty,
-                                    'scanned_item': scanned_item,
-                                    'invoice_item': matching_item
-                                })
-                            else:
-                                results.append({
-                                    'invoice_number': invoice_number,
-                                    'supc': supc,
-                                    'splitCode': splitCode,
-                                    'status': 'Eligible for credit',
-                                    'eligible': True,
-                                    'scanned_difference': scanned_difference,
-                                    'original_ship_qty': original_ship_qty,
-                                    'scanned_item': scanned_item,
-                                    'invoice_item': matching_item
-                                })
-                        else:
-                            # No previous credits found - eligible
-                            results.append({
-                                'invoice_number': invoice_number,
-                                'supc': supc,
-                                'splitCode': splitCode,
-                                'status': 'Eligible for credit as no previous processed credits has found',
-                                'eligible': True,
-                                'quantity': quantity,
-                                'delivered_rejected_sum': delivered_qty + rejected_qty,
-                                'scanned_item': scanned_item,
-                                'invoice_item': None
-                            })
-                    else:
-                        # Fully delivered/rejected
-                        results.append({
-                            'invoice_number': invoice_number,
-                            'supc': supc,
-                            'splitCode': splitCode,
-                            'status': 'Not eligible - the order is fully loaded on truck. Customer get delivered/rejected either partial/full order qty',
-                            'eligible': False,
-                            'quantity': quantity,
-                            'delivered_rejected_sum': delivered_qty + rejected_qty,
-                            'scanned_item': scanned_item,
-                            'invoice_item': None
-                        })
+    def finish(eval_key):
+        opco_number, customer_number = eval_key[0], eval_key[1]
+        pending = line_results[eval_key]
+        try:
+            customer_key = (opco_number, customer_number)
+            credit_lines = _prior_credits(pending, customer_number, opco_number, history_windows[customer_key], histories[customer_key], todayDate, fetch_cache)
+            return _finish_credit_request(pending, credit_lines)
+        except Exception as e:
+            return line_error(eval_key, e)
  
-                except Exception as e:
-                    raise Exception(f"Error processing credit request {j}: {e}")
+    pending_keys = [eval_key for eval_key, result in line_results.items() if isinstance(result, PendingCredit)]
+    line_results.update(zip(pending_keys, _map_bounded(finish, pending_keys, max_workers)))
  
-        except Exception as e:
-            raise Exception(f"Error processing sf_Details: {e}")
+    # Results are immutable records, so duplicate lines can share one
+    results = [(position, line_results[eval_key]) for position, eval_key, _ in lines]
  
-        # Group results by invoice
-        try:
-            grouped_results = {}
-            for result in results:
-                invoice_key = result['invoice_number']
-                if invoice_key not in grouped_results:
-                    grouped_results[invoice_key] = {
-                        "invoice": invoice_key,
-                        "credits_eligibility": []
-                    }
- 
-                # Calculate sot_credits_eligible
-                scanned_item = result.get('scanned_item', {})
-                quantity = scanned_item.get('quantity', 0)
-                splitCode= result.get('splitCode')
-                delivered_qty = scanned_item.get('deliveredItemQty', 0)
-                rejected_qty = scanned_item.get('rejectedItemQty', 0)
-                original_ship_qty = result.get('invoice_item', {}).get('originalShipQty', 0) if result.get('invoice_item') else 0
-                sot_credits_eligible = quantity - delivered_qty - rejected_qty + original_ship_qty
- 
-                # Find original requested quantity from sf_Details
-                requested_qty = 0
-                for item in sf_Details:
-                    for credit_req in item.get('credit_requests', []):
-                        if (credit_req.get('SUPC') == result['supc'] and
-                            credit_req.get('InvoiceNumber') == invoice_key):
-                            try:
-                                requested_qty = int(credit_req.get('MissingQuantity', 0))
-                            except (ValueError, TypeError):
-                                requested_qty = 0
-                            break
- 
-                credit_item = {
-                    "SUPC": result['supc'],
-                    "splitCode": splitCode,
-                    "sot_credits_requested": requested_qty,
-                    "sot_credits_eligible": sot_credits_eligible,
-                    "Status": result['status'],
-                    "eligibility": result['eligible'],
-                    "OrderedQuantity": quantity,
-                    "DeliveredQuantity": delivered_qty,
-                    "rejectedQuantity": rejected_qty,
-                    "previousCreditsAvailedQty": -original_ship_qty,
-                    "deliveryDate": scanned_item.get('scheduledDeliveryDate', '')
-                }
-                grouped_results[invoice_key]["credits_eligibility"].append(credit_item)
-           
-            return list(grouped_results.values())
-           
-        except Exception as e:
-            raise Exception(f"Error grouping results: {e}")
\ No newline at end of file
+    if per_entry:
+        # Bucket the results by entry once, so each entry only walks its own lines
+        results_by_entry = {}
+        for position, result in results:
+            results_by_entry.setdefault(position, []).append((position, result))
+        return [
+            _entry_outcome(entry_errors.get(position), results_by_entry.get(position, []), requested_index, output_profile)
+            for position in range(len(sf_Details))
+        ]
+ 
+    for _, result in results:
+        if isinstance(result, Exception):
+            raise result
+ 
+    # Group results by invoice
+    try:
+        return group_eligibility_results(results, requested_index, output_profile)
+    except Exception as e:
+        raise Exception(f"Error grouping results: {e}")
+
+def _entry_outcome(entry_error, entry_results, requested_index, output_profile):
+    """Grouped results for one sf_Details entry, or the Exception that failed it"""
+    if entry_error is not None:
+        return entry_error
+    for _, result in entry_results:
+        if isinstance(result, Exception):
+            return result
+    try:
+        return group_eligibility_results(entry_results, requested_index, output_profile)
+    except Exception as e:
+        return Exception(f"Error grouping results: {e}")
\ No newline at end of file
@@ -0,0 +1,104 @@
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# google.api_core errors expose the HTTP status as .code; these are worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def is_transient_error(error):
+    """Whether a create_execution failure is worth retrying"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, 'code', None) in TRANSIENT_STATUS_CODES
+
+def build_execution(case_id):
+    """Build the Workflows execution request for one case"""
+    from google.cloud.workflows import executions_v1
+    return executions_v1.Execution(argument=json.dumps({"caseid": case_id}))
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate_per_second, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst or max(1, rate_per_second))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self._sleep(wait)
+
+class WorkflowDispatcher:
+    """Starts one workflow execution per case over a single reused executions client.
+
+    Executions are created on a bounded thread pool, throttled by a token bucket
+    to stay inside Workflows quotas, and retried with jittered backoff on
+    transient errors. Any object with create_execution(parent=, execution=) works
+    as the client, so a fake can be used in tests.
+
+    With a ledger, cases that already have a live execution are skipped and
+    reported as duplicates instead of starting a second execution.
+    """
+
+    def __init__(self, client, parent, max_workers=8, rate_per_second=10, burst=None,
+                 max_retries=3, backoff_seconds=0.5, build_execution=build_execution, ledger=None, sleep=time.sleep):
+        self.client = client
+        self.parent = parent
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(rate_per_second, burst, sleep=sleep)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.build_execution = build_execution
+        self.ledger = ledger
+        self._sleep = sleep
+
+    def trigger(self, case_id):
+        """Trigger workflow for a single case ID, unless it already has a live execution"""
+        if self.ledger is not None and not self.ledger.claim(case_id):
+            return {"success": True, "case_id": case_id, "duplicate": True}
+
+        result = self._create_execution(case_id)
+        if not result["success"] and self.ledger is not None:
+            self.ledger.release(case_id)
+        return result
+
+    def _create_execution(self, case_id):
+        attempt = 0
+        while True:
+            try:
+                self.rate_limiter.acquire()
+                operation = self.client.create_execution(
+                    parent=self.parent,
+                    execution=self.build_execution(case_id)
+                )
+                return {"success": True, "case_id": case_id, "execution_name": operation.name, "attempts": attempt + 1}
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient_error(e):
+                    return {"success": False, "case_id": case_id, "error": str(e), "attempts": attempt + 1}
+                # Full jitter keeps retries from concurrent workers spread out
+                self._sleep(random.uniform(0, self.backoff_seconds * (2 ** attempt)))
+                attempt += 1
+
+    def dispatch(self, case_ids):
+        """Trigger workflows for every case ID, returning per-case results in input order.
+
+        case_ids may be any iterable, including a lazy generator; cases are
+        submitted as they arrive.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.trigger, case_id) for case_id in case_ids]
+            return [future.result() for future in futures]